@@ -30,7 +30,8 @@ setup(
             "isort>=4.3.21",
             "mypy>=0.770",
             "python-language-server>=0.36.2",
-        ]
+        ],
+        "dbus": ["dbus-next>=0.2.2"],
     },
     scripts=[
         "../bin/pulseaudio",
@@ -42,5 +43,6 @@ setup(
         "../bin/notify-send",
         "../bin/clock",
         "../bin/mpris",
+        "../bin/hudctl",
     ],
 )
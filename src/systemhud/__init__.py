@@ -2,20 +2,41 @@ import asyncio
 import signal
 import time
 from enum import IntEnum
+from os import environ
 from pathlib import Path
 from sys import stdout
-from typing import Awaitable, Callable, Dict, List, Optional, Set, Union
-
+from typing import (
+    AsyncIterable,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    TypeVar,
+    Union,
+)
+
+from systemhud import control, metrics
+from systemhud.pacing import AdaptivePeriod
 from systemhud.streams import Stream
+from systemhud.ui import notifications
 from systemhud.ui.icons import BaseIcon
+from systemhud.util import runtime_dir
 
 PKG_ROOT = list(Path(__file__).resolve().parents)[2]
+T = TypeVar("T")
 
 
 class InteractionType(IntEnum):
     LEFT_CLICK = signal.SIGUSR1
     RIGHT_CLICK = signal.SIGUSR2
 
+    @property
+    def action(self) -> str:
+        """The name it is also triggered by over the control socket."""
+        return self.name.lower().replace("_", "-")
+
 
 class Applet:
     READINESS_DELAY = 2
@@ -27,7 +48,19 @@ class Applet:
         self._interaction_handlers: Dict[
             int, Callable[[], Awaitable[None]]
         ] = {}
+        self._actions: Dict[str, control.Handler] = {}
         self._pending_tasks: List[asyncio.Task] = []
+        self.metrics = metrics.Metrics(name)
+        self.metrics.track(
+            "systemhud_notifications_total",
+            "outcome",
+            lambda: notifications.coalescer.stats,
+        )
+        self.profiler = metrics.Profiler()
+        self._queries: Dict[str, control.Query] = {
+            "metrics": self.export_metrics,
+            "profile": self.toggle_profile,
+        }
 
     def setup(
         self, setup_func: Callable[[], Awaitable[None]]
@@ -56,17 +89,38 @@ class Applet:
         return launcher
 
     def timed_update(
-        self, period: int
+        self,
+        period: float,
+        max_period: Optional[float] = None,
+        min_period: Optional[float] = None,
+        on_ac: Optional[Callable[[], bool]] = None,
     ) -> Callable[
         [Callable[[], Awaitable[Optional[BaseIcon]]]], Callable[[], None]
     ]:
+        """Runs the handler every `period`, or with a `max_period`, on an
+        `AdaptivePeriod` between `min_period` (defaulting to `period`) and
+        `max_period`, stretched further on battery when given `on_ac`."""
+
         def wrapped_update_handler(
             f: Callable[[], Awaitable[Optional[BaseIcon]]]
         ) -> Callable[[], None]:
             async def timed_update_runner() -> None:
+                loop = asyncio.get_running_loop()
+                pace = (
+                    None
+                    if max_period is None
+                    else AdaptivePeriod(period, max_period, min_period, on_ac)
+                )
                 while True:
-                    self.print_icon(await f())
-                    await asyncio.sleep(period)
+                    icon = await self._render(f.__name__, f())
+                    wait = (
+                        period
+                        if pace is None
+                        else pace.next(str(icon) if icon else None)
+                    )
+                    due = loop.time() + wait
+                    await asyncio.sleep(wait)
+                    self.metrics.lag.observe(max(0.0, loop.time() - due))
 
             self._updaters.add(timed_update_runner)
             return self.make_launcher(timed_update_runner)
@@ -87,25 +141,87 @@ class Applet:
                     if isinstance(input_stream, str)
                     else input_stream
                 ):
-                    self.print_icon(await f(line.strip()))
+                    await self._render(f.__name__, f(line.strip()))
 
             self._updaters.add(stream_update_runner)
             return self.make_launcher(stream_update_runner)
 
         return wrapped_stream_handler
 
+    def event_update(
+        self, source: Callable[[], AsyncIterable[T]]
+    ) -> Callable[
+        [Callable[[T], Awaitable[Optional[BaseIcon]]]], Callable[[], None]
+    ]:
+        # Like the stream updates, but for sources that already produce
+        # structured events (i.e. D-Bus signals) rather than lines of text
+        def wrapped_event_handler(
+            f: Callable[[T], Awaitable[Optional[BaseIcon]]]
+        ) -> Callable[[], None]:
+            async def event_update_runner() -> None:
+                async for event in source():
+                    await self._render(f.__name__, f(event))
+
+            self._updaters.add(event_update_runner)
+            return self.make_launcher(event_update_runner)
+
+        return wrapped_event_handler
+
     def interaction(
-        self, trigger: InteractionType
-    ) -> Callable[[Callable[[], Awaitable[None]]], Callable[[], None]]:
-        def wrapped_interaction_handler(f: Callable[[], Awaitable[None]]):
-            self._interaction_handlers[trigger.value] = f
+        self, trigger: Union[InteractionType, str]
+    ) -> Callable[[control.Handler], Callable[[], None]]:
+        """Registers a handler for a named action (called with the
+        action's arguments) or a click, which can also be signalled."""
+
+        def wrapped_interaction_handler(f: control.Handler):
+            if isinstance(trigger, InteractionType):
+                self._interaction_handlers[trigger.value] = f
+                self._actions[trigger.action] = f
+            else:
+                self._actions[trigger] = f
             return self.make_launcher(f)
 
         return wrapped_interaction_handler
 
+    action = interaction
+
     def run(self) -> None:
         asyncio.run(self._run())
 
+    async def _render(
+        self, handler: str, update: Awaitable[Optional[BaseIcon]]
+    ) -> Optional[BaseIcon]:
+        start = time.perf_counter()
+        icon = await update
+        self.metrics.observe(
+            handler, time.perf_counter() - start, rendered=bool(icon)
+        )
+        self.print_icon(icon)
+        return icon
+
+    def toggle_profile(self) -> str:
+        """Starts the sampling profiler, or stops it and writes out what it
+        collected."""
+        if not self.profiler.running:
+            self.profiler.start()
+            return "profiling" if self.profiler.running else "unsupported"
+
+        self.profiler.stop()
+        return f"written to {self._write_profile()}"
+
+    def _write_profile(self) -> Path:
+        path = runtime_dir() / f"{self.name}.folded"
+        path.write_text(self.profiler.folded())
+        return path
+
+    def export_metrics(self) -> str:
+        """The metrics, also written out to `APPLET.prom` for a Prometheus
+        textfile collector."""
+        try:
+            return self.metrics.export(runtime_dir() / f"{self.name}.prom")
+        except OSError:
+            return self.metrics.prometheus()
+
     def print_icon(self, icon: Union[None, BaseIcon, str]) -> None:
         if not icon:
             return
@@ -153,10 +269,18 @@ class Applet:
             if setup_hooks:  # Don't sleep if all hooks finished cleanly
                 time.sleep(self.READINESS_DELAY)
 
-        for signal, handler in self._interaction_handlers.items():
-            loop.add_signal_handler(
-                signal, lambda: asyncio.create_task(handler())
-            )
+        server = control.ControlServer(self.name, self._actions, self._queries)
+        for signum, handler in self._interaction_handlers.items():
+            loop.add_signal_handler(signum, server.dispatch, handler)
+
+        try:
+            await server.start()
+        except OSError:
+            # no runtime directory, the signals still work
+            pass
+
+        if environ.get("SYSTEMHUD_PROFILE"):
+            self.profiler.start()
 
         self._pending_tasks = [asyncio.create_task(u()) for u in self._updaters]
         try:
@@ -164,3 +288,12 @@ class Applet:
         except Exception:
             await self.cleanup()
             raise
+        finally:
+            server.close()
+            self.export_metrics()
+            if self.profiler.running:
+                self.profiler.stop()
+                try:
+                    self._write_profile()
+                except OSError:
+                    pass
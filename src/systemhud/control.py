@@ -0,0 +1,139 @@
+"""
+A per applet unix socket for triggering its actions, a request being a
+single line of the action's name and its arguments (shell quoted) that is
+answered with `ok` once dispatched or `error` and the reason.  Replaces
+signalling the applet, which only gives two (argument-less) actions.
+Queries are answered inline instead, with their output following the
+`ok` line.
+"""
+import asyncio
+import inspect
+import shlex
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from systemhud.util import runtime_dir
+
+Handler = Callable[..., Awaitable[None]]
+Query = Callable[..., str]
+# annotations arguments are converted to, anything else is passed as is
+ARGUMENT_TYPES = (int, float)
+# answered by the server itself, with the names of the applet's actions
+LIST_ACTIONS = "actions"
+TIMEOUT = 2.0
+
+
+def socket_path(name: str) -> Path:
+    return runtime_dir() / f"{name}.sock"
+
+
+def convert(handler: Callable[..., Any], args: List[str]) -> List[Any]:
+    """Matches the arguments to the handler's parameters, converting the
+    ones annotated as numbers (i.e. `level: float`), raises a ValueError
+    describing what doesn't fit."""
+    signature = inspect.signature(handler)
+    try:
+        bound = signature.bind(*args)
+    except TypeError as e:
+        raise ValueError(str(e))
+
+    converted: List[Any] = []
+    for name, value in bound.arguments.items():
+        parameter = signature.parameters[name]
+        values = (
+            value if parameter.kind is parameter.VAR_POSITIONAL else [value]
+        )
+        for v in values:
+            if parameter.annotation not in ARGUMENT_TYPES:
+                converted.append(v)
+                continue
+            try:
+                converted.append(parameter.annotation(v))
+            except ValueError:
+                raise ValueError(
+                    f"{name} should be a {parameter.annotation.__name__},"
+                    f" not {v!r}"
+                )
+
+    return converted
+
+
+class ControlServer:
+    def __init__(
+        self,
+        name: str,
+        actions: Dict[str, Handler],
+        queries: Optional[Dict[str, Query]] = None,
+    ):
+        self.path = socket_path(name)
+        self.actions = actions
+        self.queries = queries if queries else {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        # running handlers, referenced so they aren't collected early
+        self._running: Set["asyncio.Future[None]"] = set()
+
+    async def start(self) -> None:
+        # a previous run that didn't get to clean up leaves its socket
+        if self.path.is_socket():
+            self.path.unlink()
+        self._server = await asyncio.start_unix_server(
+            self._handle, path=str(self.path)
+        )
+
+    def dispatch(self, handler: Handler, *args: Any) -> None:
+        task = asyncio.ensure_future(handler(*args))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    def _request(self, line: str) -> str:
+        try:
+            name, *args = shlex.split(line)
+        except ValueError as e:
+            return f"error {e}"
+
+        if name == LIST_ACTIONS:
+            return "ok " + " ".join(sorted({**self.actions, **self.queries}))
+
+        try:
+            if name in self.queries:
+                query = self.queries[name]
+                return "ok\n" + query(*convert(query, args)).rstrip("\n")
+            if name in self.actions:
+                handler = self.actions[name]
+                # checked up front, so a bad argument is answered rather
+                # than failing in the handler after the `ok`
+                self.dispatch(handler, *convert(handler, args))
+                return "ok"
+        except ValueError as e:
+            return f"error {name}: {e}"
+
+        return f"error unknown action: {name}"
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            line = await asyncio.wait_for(reader.readline(), TIMEOUT)
+            try:
+                answer = self._request(line.decode())
+            except Exception as e:
+                # i.e. a query failing to write its output out, the client
+                # still gets an answer
+                answer = "error " + " ".join(str(e).split())
+            writer.write((answer + "\n").encode())
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self) -> None:
+        if self._server is None:
+            return
+
+        self._server.close()
+        self._server = None
+        try:
+            self.path.unlink()
+        except OSError:
+            pass
@@ -0,0 +1,206 @@
+"""
+Small asyncio helpers over `dbus-next`, for the backends that talk to system
+services directly instead of scraping their command line tools.  The import
+is deferred (like `gi` in the notifications) so nothing breaks when it isn't
+installed, check `available()` before choosing a D-Bus backend.
+"""
+import asyncio
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from systemhud.errors import DBusError
+
+SYSTEM = "system"
+SESSION = "session"
+DBUS_SERVICE = "org.freedesktop.DBus"
+DBUS_PATH = "/org/freedesktop/DBus"
+PROPERTIES = "org.freedesktop.DBus.Properties"
+OBJECT_MANAGER = "org.freedesktop.DBus.ObjectManager"
+
+_buses: Dict[Tuple[int, str, Optional[str]], "asyncio.Future[Any]"] = {}
+
+
+@lru_cache(maxsize=None)
+def available() -> bool:
+    # asked on every notification, the answer doesn't change while running
+    try:
+        import dbus_next  # noqa: F401
+    except ImportError:
+        return False
+
+    return True
+
+
+async def get_bus(
+    bus_type: str = SESSION, address: Optional[str] = None
+) -> Any:
+    """Returns a connected bus, shared by everything running on this loop.
+    An explicit `address` (i.e. a private `dbus-daemon`) overrides the
+    well known bus for `bus_type`."""
+    from dbus_next import BusType
+    from dbus_next.aio import MessageBus
+
+    key = (id(asyncio.get_running_loop()), bus_type, address)
+    if key in _buses:
+        pending = _buses[key]
+        if not pending.done() or pending.result().connected:
+            return await pending
+
+    bus = (
+        MessageBus(bus_address=address)
+        if address is not None
+        else MessageBus(
+            bus_type=BusType.SYSTEM if bus_type == SYSTEM else BusType.SESSION
+        )
+    )
+    _buses[key] = asyncio.ensure_future(bus.connect())
+    try:
+        return await _buses[key]
+    except Exception:
+        del _buses[key]
+        raise
+
+
+async def release(
+    bus_type: str = SESSION, address: Optional[str] = None
+) -> None:
+    """Disconnects the shared bus for this loop, for short lived loops (i.e.
+    `asyncio.run` in a script) that won't be around to reuse it."""
+    key = (id(asyncio.get_running_loop()), bus_type, address)
+    pending = _buses.pop(key, None)
+    if pending is None or not pending.done() or pending.exception():
+        return
+
+    bus = pending.result()
+    bus.disconnect()
+    await bus.wait_for_disconnect()
+
+
+def variant(signature: str, value: Any) -> Any:
+    from dbus_next import Variant
+
+    return Variant(signature, value)
+
+
+def unwrap(value: Any) -> Any:
+    """Strips the `Variant` wrappers out of a (possibly nested) value."""
+    from dbus_next import Variant
+
+    if isinstance(value, Variant):
+        return unwrap(value.value)
+    elif isinstance(value, dict):
+        return {k: unwrap(v) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [unwrap(v) for v in value]
+
+    return value
+
+
+async def call(
+    bus: Any,
+    destination: str,
+    path: str,
+    interface: str,
+    member: str,
+    signature: str = "",
+    body: Optional[List[Any]] = None,
+) -> List[Any]:
+    from dbus_next import Message, MessageType
+
+    reply = await bus.call(
+        Message(
+            destination=destination,
+            path=path,
+            interface=interface,
+            member=member,
+            signature=signature,
+            body=body or [],
+        )
+    )
+    if reply.message_type == MessageType.ERROR:
+        raise DBusError(reply.error_name, *reply.body)
+
+    return reply.body
+
+
+async def _add_match(bus: Any, **rule: str) -> None:
+    await call(
+        bus,
+        DBUS_SERVICE,
+        DBUS_PATH,
+        DBUS_SERVICE,
+        "AddMatch",
+        "s",
+        [",".join(f"{k}='{v}'" for k, v in rule.items())],
+    )
+
+
+async def subscribe(
+    bus: Any, handler: Callable[[Any], None], **rule: str
+) -> None:
+    """Adds a match rule (`type="signal", interface=...`) to the bus and
+    routes the signals matching it to `handler`.  The connection is shared,
+    so the other subscriptions' signals come through here as well and are
+    filtered out by sender, path, interface and member.  Signals carry the
+    sender's unique name, a well known `sender` is followed to its current
+    owner."""
+    from dbus_next import MessageType
+
+    await _add_match(bus, **rule)
+
+    sender = rule.get("sender")
+    owner = sender
+    follow_owner = False
+    if sender is not None and not sender.startswith(":"):
+        follow_owner = True
+        await _add_match(
+            bus,
+            type="signal",
+            sender=DBUS_SERVICE,
+            interface=DBUS_SERVICE,
+            member="NameOwnerChanged",
+            arg0=sender,
+        )
+        try:
+            (owner,) = await call(
+                bus,
+                DBUS_SERVICE,
+                DBUS_PATH,
+                DBUS_SERVICE,
+                "GetNameOwner",
+                "s",
+                [sender],
+            )
+        except DBusError:
+            # not running (yet), picked up from NameOwnerChanged
+            owner = None
+
+    def filtered_handler(msg: Any) -> None:
+        nonlocal owner
+        if msg.message_type != MessageType.SIGNAL:
+            return
+        if (
+            follow_owner
+            and msg.sender == DBUS_SERVICE
+            and msg.member == "NameOwnerChanged"
+            and msg.body[0] == sender
+        ):
+            owner = msg.body[2] or None
+            return
+        if sender is not None and msg.sender != owner:
+            return
+        if "path" in rule and msg.path != rule["path"]:
+            return
+        if "path_namespace" in rule and not (
+            msg.path == rule["path_namespace"]
+            or msg.path.startswith(rule["path_namespace"].rstrip("/") + "/")
+        ):
+            return
+        if "interface" in rule and msg.interface != rule["interface"]:
+            return
+        if "member" in rule and msg.member != rule["member"]:
+            return
+
+        handler(msg)
+
+    bus.add_message_handler(filtered_handler)
@@ -1,3 +1,9 @@
 class ExecutableNotFound(Exception):
     def __init__(self, target: str):
         super().__init__(f"The target command: {target} is not resolvable.")
+
+
+class DBusError(Exception):
+    def __init__(self, name: str, *details: str):
+        super().__init__(f"{name}: {' '.join(details)}" if details else name)
+        self.name = name
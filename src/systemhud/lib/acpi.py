@@ -1,8 +1,30 @@
+import time
 from enum import Enum
 from pathlib import Path
 from typing import Optional
 
+from systemhud import timeseries
 from systemhud.streams import capture
+from systemhud.timeseries import Resolution, Series
+
+POWER_SUPPLY = Path("/sys/class/power_supply")
+# how far back the drain rate looks
+DRAIN_WINDOW = 3600
+
+
+def on_ac() -> bool:
+    """Whether it's running off of mains power (a machine without any
+    supplies listed is assumed to be).  A few sysfs reads, cheap enough to
+    ask on every update and so never behind on a switch to battery."""
+    mains = []
+    try:
+        for supply in POWER_SUPPLY.iterdir():
+            if (supply / "type").read_text().strip() == "Mains":
+                mains.append((supply / "online").read_text().strip() == "1")
+    except OSError:
+        pass
+
+    return any(mains) or not mains
 
 
 class Status(Enum):
@@ -18,18 +40,41 @@ class Status(Enum):
 
 
 class Battery:
-    DEV_PATH = Path("/sys/class/power_supply")
+    DEV_PATH = POWER_SUPPLY
     _status: Optional[Status]
     _capacity: Optional[int]
 
     def __init__(self, bat_name: str = "BAT0"):
         self.path = Battery.DEV_PATH / bat_name
+        # capacity and whether it was discharging
+        self.history = Series(f"battery-{bat_name}", width=2)
         self.uncache()
 
     def uncache(self) -> None:
         self._status = None
         self._capacity = None
 
+    def update(self) -> None:
+        """Reads the battery again and records it."""
+        self.uncache()
+        self.history.append(
+            [self.capacity, float(self.status is Status.DISCHARGING)]
+        )
+
+    def drain_rate(self) -> Optional[float]:
+        """Percent per hour lost since it was last plugged in (looking back
+        an hour at most), None until there's enough to tell."""
+        samples = self.history.samples(
+            Resolution.MINUTE, time.time() - DRAIN_WINDOW
+        )
+        start = 0
+        for i, (_, (_, discharging)) in enumerate(samples):
+            if discharging < 1.0:
+                start = i + 1
+
+        drain = timeseries.rate(samples[start:])
+        return -drain if drain is not None else None
+
     @property
     def status(self) -> Status:
         if self._status is None:
@@ -1,5 +1,21 @@
-from typing import Dict, Optional, Tuple
-
+import asyncio
+import time
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Container,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from systemhud import dbus
+from systemhud.errors import DBusError
 from systemhud.streams import capture, run
 from systemhud.util import ReversableEnum, strip_ansi
 
@@ -19,6 +35,32 @@ class Type(ReversableEnum):
     CONTROLLER = "Controller"
 
 
+# (status, type, device id, changed properties) as emitted by `Bluez.events`
+Event = Tuple[Optional[Status], Optional[Type], str, Dict[str, Any]]
+# (status, type, device id, remainder) as parsed from `bluetoothctl` output
+LogLine = Tuple[Optional[Status], Optional[Type], str, str]
+NO_MATCH: LogLine = (None, None, "", "")
+# seconds a `bluetoothctl info` result is trusted for
+INFO_TTL = 60.0
+# how many `bluetoothctl info` calls may run at once
+MAX_CONCURRENT_INFO = 4
+# property names (bluetoothctl and bluez) carrying the telemetry readings
+BATTERY_PROPERTIES = ["Battery Percentage", "Percentage"]
+RSSI_PROPERTIES = ["RSSI"]
+
+
+def parse_number(raw: Any) -> int:
+    """bluetoothctl prints numbers as `0x55 (85)` or `-60`, D-Bus gives us an
+    actual int."""
+    if isinstance(raw, int):
+        return raw
+
+    raw = str(raw)
+    if "(" in raw:
+        raw = raw.split("(", 1)[1].rstrip(")")
+    return int(raw, 0)
+
+
 class Device:
     # For some reason, my bluetooth headphones identify as an audio card, which
     # is kind of annoying from a UI perspective, so add in a translation table
@@ -30,14 +72,32 @@ class Device:
     name: str
     _icon: str
     connected: bool = False
-
-    def __init__(self, device_id: str):
+    paired: bool = True
+    battery: Optional[int] = None
+    rssi: Optional[int] = None
+    backend: Optional["Bluez"] = None
+    path: str = ""
+    # monotonic time of the last info fetch, 0 marks it as stale
+    updated_at: float = 0.0
+
+    def __init__(
+        self,
+        device_id: str,
+        backend: Optional["Bluez"] = None,
+        path: str = "",
+    ):
         self.device_id = device_id
         self.name = ""
         self.connected = False
         self._icon = ""
+        self.backend = backend
+        self.path = path
 
-    async def _get_info(self) -> None:
+    async def _get_info(self) -> Dict[str, Any]:
+        if self.backend is not None:
+            return await self.backend.get_properties(self.path)
+
+        props: Dict[str, Any] = {}
         for line in await capture(f"bluetoothctl info {self.device_id}"):
             line = line.strip()
             try:
@@ -45,12 +105,32 @@ class Device:
             except ValueError:
                 continue
 
-            if k in ["Name", "Alias"]:
-                self.name = v.strip()
-            elif k == "Connected":
-                self.connected = v.strip() == "yes"
-            elif k == "Icon":
-                self._icon = v.strip()
+            v = v.strip()
+            props[k] = (v == "yes") if v in ["yes", "no"] else v
+
+        return props
+
+    def apply(self, props: Dict[str, Any]) -> bool:
+        """Merge a set of (bluez named) properties into the device, if the
+        connection status changed, will return True."""
+        previous_status = self.connected
+        for k in ["Name", "Alias"]:
+            if k in props:
+                self.name = props[k]
+        if "Connected" in props:
+            self.connected = bool(props["Connected"])
+        if "Paired" in props:
+            self.paired = bool(props["Paired"])
+        if "Icon" in props:
+            self._icon = props["Icon"]
+        for k in BATTERY_PROPERTIES:
+            if k in props:
+                self.battery = parse_number(props[k])
+        for k in RSSI_PROPERTIES:
+            if k in props:
+                self.rssi = parse_number(props[k])
+
+        return self.connected != previous_status
 
     @property
     def icon(self) -> str:
@@ -59,21 +139,39 @@ class Device:
     async def update(self) -> bool:
         """Update the info for this device, if the connection status changed,
         will return True."""
-        previous_status = self.connected
-        await self._get_info()
-        return self.connected != previous_status
+        changed = self.apply(await self._get_info())
+        self.updated_at = time.monotonic()
+        return changed
+
+    async def sample(self) -> None:
+        """Refresh only the battery and signal readings, a change of the
+        connection status is left to be reported by whoever follows them."""
+        props = await self._get_info()
+        self.apply(
+            {
+                k: v
+                for k, v in props.items()
+                if k in BATTERY_PROPERTIES + RSSI_PROPERTIES
+            }
+        )
 
     async def connect(self) -> None:
         if self.connected:
             return
 
-        await run(f"bluetoothctl connect {self.device_id}")
+        if self.backend is not None:
+            await self.backend.call_device(self.path, "Connect")
+        else:
+            await run(f"bluetoothctl connect {self.device_id}")
 
     async def disconnect(self) -> None:
         if not self.connected:
             return
 
-        await run(f"bluetoothctl disconnect {self.device_id}")
+        if self.backend is not None:
+            await self.backend.call_device(self.path, "Disconnect")
+        else:
+            await run(f"bluetoothctl disconnect {self.device_id}")
 
     async def toggle(self) -> None:
         await self.disconnect() if self.connected else await self.connect()
@@ -84,21 +182,87 @@ class Device:
         )
 
 
-async def get_devices() -> Dict[str, Device]:
-    dev_list = await capture("bluetoothctl paired-devices")
+class InfoCache:
+    """Holds on to the paired `Device`s (keyed by MAC) between `get_devices`
+    calls so opening the menu doesn't wait on a `bluetoothctl info` for
+    every device.  Entries are refreshed after `ttl` seconds or as soon as
+    the event stream reports a change for them (see `observe`).
+    """
+
+    def __init__(
+        self, ttl: float = INFO_TTL, concurrency: int = MAX_CONCURRENT_INFO
+    ):
+        self.ttl = ttl
+        self.concurrency = concurrency
+        self.devices: Dict[str, Device] = {}
+        self._paired: List[str] = []
+        self._paired_at = 0.0
+
+    def is_fresh(self, updated_at: float) -> bool:
+        return time.monotonic() - updated_at < self.ttl
+
+    def invalidate(self, dev_id: Optional[str] = None) -> None:
+        if dev_id is None:
+            self._paired_at = 0.0
+            for device in self.devices.values():
+                device.updated_at = 0.0
+        elif dev_id in self.devices:
+            self.devices[dev_id].updated_at = 0.0
+
+    def observe(
+        self, status: Optional[Status], dev_type: Optional[Type], dev_id: str
+    ) -> None:
+        """Drop whatever a `bluetoothctl` event line made stale."""
+        if dev_type is Type.CONTROLLER:
+            self.invalidate()
+        elif dev_type is Type.DEVICE:
+            if status is Status.CHANGED:
+                self.invalidate(dev_id)
+            elif status is not None:
+                self._paired_at = 0.0
+
+    async def _paired_ids(self) -> List[str]:
+        if self.is_fresh(self._paired_at):
+            return self._paired
+
+        self._paired = []
+        for line in await capture("bluetoothctl paired-devices"):
+            try:
+                _, dev_id, _ = line.split(" ", 2)
+            except ValueError:
+                continue
 
-    devices: Dict[str, Device] = {}
+            self._paired.append(dev_id)
 
-    for line in dev_list:
-        try:
-            _, dev_id, _ = line.split(" ", 2)
-        except ValueError:
-            continue
+        self._paired_at = time.monotonic()
+        return self._paired
+
+    async def get_devices(self) -> Dict[str, Device]:
+        devices: Dict[str, Device] = {}
+        for dev_id in await self._paired_ids():
+            devices[dev_id] = self.devices.setdefault(dev_id, Device(dev_id))
+
+        limiter = asyncio.Semaphore(self.concurrency)
+
+        async def limited_update(device: Device) -> None:
+            async with limiter:
+                await device.update()
+
+        await asyncio.gather(
+            *[
+                limited_update(d)
+                for d in devices.values()
+                if not self.is_fresh(d.updated_at)
+            ]
+        )
+        return devices
 
-        devices[dev_id] = Device(dev_id)
-        await devices[dev_id].update()
 
-    return devices
+info_cache = InfoCache()
+
+
+async def get_devices() -> Dict[str, Device]:
+    return await info_cache.get_devices()
 
 
 async def get_status() -> bool:
@@ -122,20 +286,365 @@ async def toggle() -> None:
         await run("bluetoothctl power on")
 
 
-def parse_logline(
-    raw_msg: str,
-) -> Tuple[Optional[Status], Optional[Type], str, str]:
-    raw_line = raw_msg.split("\r")[-1]
-    line = strip_ansi(raw_line)
-    if not line.startswith("["):
-        return None, None, "", ""
+class Bluez:
+    """Talks to bluez over the system bus rather than going through
+    `bluetoothctl`, the initial state comes from a single `GetManagedObjects`
+    call and is then kept current by the property/interface signals, so no
+    process is spawned per event.  `bus_address` allows pointing it at a
+    private `dbus-daemon` (e.g. one serving a mock `org.bluez` tree).
+    """
+
+    SERVICE = "org.bluez"
+    ADAPTER = "org.bluez.Adapter1"
+    DEVICE = "org.bluez.Device1"
+    BATTERY = "org.bluez.Battery1"
+
+    def __init__(self, bus_address: Optional[str] = None):
+        self.bus_address = bus_address
+        self.bus: Any = None
+        self.adapter_path = ""
+        self.adapter_id = ""
+        self.powered = False
+        self.devices: Dict[str, Device] = {}
+        self._paths: Dict[str, str] = {}
+        self._events: Optional["asyncio.Queue[Event]"] = None
+        # the signals already routed here, per bus connection
+        self._subscribed: Set[Tuple[int, str]] = set()
+
+    @staticmethod
+    def available() -> bool:
+        return dbus.available()
+
+    async def start(self) -> None:
+        """Subscribes to bluez's signals and takes the initial snapshot,
+        `bus` is only set once both worked so a failed start (i.e. bluez
+        isn't up yet) can simply be retried."""
+        bus = await dbus.get_bus(dbus.SYSTEM, self.bus_address)
+        if self._events is None:
+            self._events = asyncio.Queue()
+
+        # subscribe before the snapshot so nothing falls in between the two
+        for iface, member, handler in [
+            (dbus.PROPERTIES, "PropertiesChanged", self._properties_changed),
+            (dbus.OBJECT_MANAGER, "InterfacesAdded", self._interfaces_added),
+            (
+                dbus.OBJECT_MANAGER,
+                "InterfacesRemoved",
+                self._interfaces_removed,
+            ),
+        ]:
+            if (id(bus), member) in self._subscribed:
+                continue
+            await dbus.subscribe(
+                bus,
+                handler,
+                type="signal",
+                sender=self.SERVICE,
+                interface=iface,
+                member=member,
+            )
+            self._subscribed.add((id(bus), member))
+
+        (objects,) = await dbus.call(
+            bus,
+            self.SERVICE,
+            "/",
+            dbus.OBJECT_MANAGER,
+            "GetManagedObjects",
+        )
+        for path, interfaces in objects.items():
+            self._add(path, dbus.unwrap(interfaces))
+        self.bus = bus
+
+    async def events(self) -> AsyncIterator[Event]:
+        assert self._events is not None, "Bluez.start() has not been called."
+        while True:
+            yield await self._events.get()
+
+    def _emit(
+        self, status: Status, dev_type: Type, dev_id: str, changes: Dict
+    ) -> None:
+        if self._events is not None:
+            self._events.put_nowait((status, dev_type, dev_id, changes))
+
+    def _add(self, path: str, interfaces: Dict[str, Dict[str, Any]]) -> None:
+        if self.ADAPTER in interfaces and not self.adapter_path:
+            props = interfaces[self.ADAPTER]
+            self.adapter_path = path
+            self.adapter_id = props.get("Address", "")
+            self.powered = bool(props.get("Powered", False))
+        if self.DEVICE in interfaces:
+            props = interfaces[self.DEVICE]
+            dev_id = props.get("Address", path.rsplit("/", 1)[-1])
+            self._paths[path] = dev_id
+            self.devices[dev_id] = Device(dev_id, backend=self, path=path)
+            self.devices[dev_id].apply(props)
+            self._emit(Status.STARTED_PAIRING, Type.DEVICE, dev_id, props)
+        # the battery interface is usually added after the device connects
+        if self.BATTERY in interfaces and path in self._paths:
+            props = interfaces[self.BATTERY]
+            dev_id = self._paths[path]
+            self.devices[dev_id].apply(props)
+            self._emit(Status.CHANGED, Type.DEVICE, dev_id, props)
+
+    def _interfaces_added(self, msg: Any) -> None:
+        path, interfaces = msg.body
+        self._add(path, dbus.unwrap(interfaces))
+
+    def _interfaces_removed(self, msg: Any) -> None:
+        path, interfaces = msg.body
+        if self.DEVICE in interfaces and path in self._paths:
+            dev_id = self._paths.pop(path)
+            self.devices.pop(dev_id, None)
+            self._emit(Status.STOPPED_PAIRING, Type.DEVICE, dev_id, {})
+
+    def _properties_changed(self, msg: Any) -> None:
+        iface, raw_changes, _ = msg.body
+        changes = dbus.unwrap(raw_changes)
+        if iface == self.ADAPTER and msg.path == self.adapter_path:
+            if "Powered" in changes:
+                self.powered = bool(changes["Powered"])
+            self._emit(
+                Status.CHANGED, Type.CONTROLLER, self.adapter_id, changes
+            )
+        elif iface in [self.DEVICE, self.BATTERY] and msg.path in self._paths:
+            dev_id = self._paths[msg.path]
+            self.devices[dev_id].apply(changes)
+            self._emit(Status.CHANGED, Type.DEVICE, dev_id, changes)
+
+    async def get_properties(self, path: str) -> Dict[str, Any]:
+        props: Dict[str, Any] = {}
+        for iface in [self.DEVICE, self.BATTERY]:
+            try:
+                (iface_props,) = await dbus.call(
+                    self.bus,
+                    self.SERVICE,
+                    path,
+                    dbus.PROPERTIES,
+                    "GetAll",
+                    "s",
+                    [iface],
+                )
+            except DBusError:
+                # not every device exposes a battery
+                continue
+            props.update(dbus.unwrap(iface_props))
+
+        return props
+
+    async def call_device(self, path: str, method: str) -> None:
+        await dbus.call(self.bus, self.SERVICE, path, self.DEVICE, method)
+
+    async def get_devices(self) -> Dict[str, Device]:
+        return {k: d for k, d in self.devices.items() if d.paired}
+
+    async def get_status(self) -> bool:
+        return self.powered
+
+    async def toggle(self) -> None:
+        await dbus.call(
+            self.bus,
+            self.SERVICE,
+            self.adapter_path,
+            dbus.PROPERTIES,
+            "Set",
+            "ssv",
+            [self.ADAPTER, "Powered", dbus.variant("b", not self.powered)],
+        )
+
+
+class TelemetrySampler:
+    """Samples the battery and signal of connected devices on an adaptive
+    schedule.  A device is polled every `min_period` while its readings are
+    moving (or the battery is low), and the period doubles up to
+    `max_period` for every sample that comes back unchanged.  Readings that
+    the backend pushes on its own go through `push`, which counts as a fresh
+    sample and wakes `samples` up immediately, as does `wake` when a device
+    connects.
+    """
+
+    MIN_PERIOD = 30.0
+    MAX_PERIOD = 900.0
+    LOW_BATTERY = 20
+    # RSSI jitters by a few dBm even when nothing moves
+    RSSI_TOLERANCE = 5
+
+    def __init__(
+        self,
+        devices: Callable[[], Awaitable[Dict[str, Device]]],
+        min_period: float = MIN_PERIOD,
+        max_period: float = MAX_PERIOD,
+        low_battery: int = LOW_BATTERY,
+    ):
+        self.devices = devices
+        self.min_period = min_period
+        self.max_period = max_period
+        self.low_battery = low_battery
+        self._periods: Dict[str, float] = {}
+        self._due: Dict[str, float] = {}
+        self._readings: Dict[str, Tuple[Optional[int], Optional[int]]] = {}
+        self._pushed: List[Device] = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def is_low(self, device: Device) -> bool:
+        return device.battery is not None and device.battery <= self.low_battery
+
+    def _record(self, device: Device) -> bool:
+        """Schedules the next sample for `device` based on the reading it
+        holds now, returns True if that reading moved."""
+        previous_battery, previous_rssi = self._readings.get(
+            device.device_id, (None, None)
+        )
+        changed = device.battery != previous_battery or (
+            (device.rssi is None) != (previous_rssi is None)
+            or (
+                device.rssi is not None
+                and previous_rssi is not None
+                and abs(device.rssi - previous_rssi) > self.RSSI_TOLERANCE
+            )
+        )
+        if changed:
+            self._readings[device.device_id] = device.battery, device.rssi
+
+        if changed or self.is_low(device):
+            period = self.min_period
+        else:
+            period = min(
+                self._periods.get(device.device_id, self.min_period) * 2,
+                self.max_period,
+            )
+        self._periods[device.device_id] = period
+        self._due[device.device_id] = time.monotonic() + period
+        return changed
+
+    def wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def push(self, device: Device) -> None:
+        if self._record(device):
+            self._pushed.append(device)
+            self.wake()
+
+    async def samples(self) -> AsyncIterator[Device]:
+        """Yields devices whenever their battery or signal reading moved."""
+        self._wakeup = asyncio.Event()
+        while True:
+            self._wakeup.clear()
+            pushed, self._pushed = self._pushed, []
+            for device in pushed:
+                yield device
+
+            now = time.monotonic()
+            connected = [
+                d for d in (await self.devices()).values() if d.connected
+            ]
+            due = [d for d in connected if self._due.get(d.device_id, 0) <= now]
+            await asyncio.gather(*[d.sample() for d in due])
+            for device in due:
+                if self._record(device):
+                    yield device
+
+            next_sample = min(
+                [self._due[d.device_id] for d in connected],
+                default=now + self.max_period,
+            )
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(),
+                    max(next_sample - time.monotonic(), 0),
+                )
+            except asyncio.TimeoutError:
+                pass
+
+
+class LogLexer:
+    """Tokenizer for the `bluetoothctl` event stream.
+
+    The common line is a prompt redraw followed by a (colored) event, i.e.
+    `[bluetooth]# \\r\\x1b[K\\x1b[0;93m[CHG]\\x1b[0m Device <MAC> RSSI: -60`,
+    so rather than stripping escapes and splitting every line, the event
+    token is found from the first `]` after the last carriage return and
+    resolved through a lookup table.  Property changes that nothing consumes
+    (and, if `watched` is given, changes for devices not in it) are dropped
+    by comparing in place, before anything is sliced out of the line.
+    Anything not shaped like that goes through the old generic parse.
+    """
+
+    STATUSES = {f"[{status.value}]": status for status in Status}
+    TYPES = tuple((f"{dev_type.value} ", dev_type) for dev_type in Type)
+    COLOR_RESET = "\x1b[0m"
+    IGNORED_PROPERTIES = (
+        "ManufacturerData",
+        "ServiceData",
+        "AdvertisingData",
+        "AdvertisingFlags",
+        "TxPower",
+        "UUIDs",
+    )
+
+    def __init__(
+        self,
+        ignored: Sequence[str] = IGNORED_PROPERTIES,
+        watched: Optional[Container[str]] = None,
+    ):
+        self.ignored = tuple(ignored)
+        self.watched = watched
+
+    def parse(self, raw: str) -> LogLine:
+        start = raw.rfind("\r") + 1
+        end = raw.find("]", start)
+        status = self.STATUSES.get(raw[end - 4 : end + 1]) if end > 3 else None
+        if status is None:
+            return self._parse_generic(raw[start:])
+
+        pos = end + 1
+        if raw.startswith(self.COLOR_RESET, pos):
+            pos += len(self.COLOR_RESET)
+        if not raw.startswith(" ", pos):
+            return self._parse_generic(raw[start:])
+        pos += 1
+
+        for prefix, dev_type in self.TYPES:
+            if raw.startswith(prefix, pos):
+                pos += len(prefix)
+                break
+        else:
+            return NO_MATCH
+
+        sep = raw.find(" ", pos)
+        if sep == -1:
+            return NO_MATCH
+        if status is Status.CHANGED:
+            if raw.startswith(self.ignored, sep + 1):
+                return NO_MATCH
+            if (
+                dev_type is Type.DEVICE
+                and self.watched is not None
+                and raw[pos:sep] not in self.watched
+            ):
+                return NO_MATCH
+
+        misc = raw[sep + 1 :]
+        if "\x1b" in misc:
+            misc = strip_ansi(misc)
+        return status, dev_type, raw[pos:sep], misc
+
+    def _parse_generic(self, raw_line: str) -> LogLine:
+        line = strip_ansi(raw_line)
+        if not line.startswith("["):
+            return NO_MATCH
+
+        try:
+            raw_status, raw_type, dev_id, misc = line.split(" ", 3)
+        except ValueError:
+            return NO_MATCH
+
+        return Status.rlookup(raw_status), Type.rlookup(raw_type), dev_id, misc
+
 
-    try:
-        raw_status, raw_type, dev_id, misc = line.split(" ", 3)
-    except ValueError:
-        return None, None, "", ""
+lexer = LogLexer()
 
-    status = Status.rlookup(raw_status.strip("[]"))
-    dev_type = Type.rlookup(raw_type)
 
-    return status, dev_type, dev_id, misc
+def parse_logline(raw_msg: str) -> LogLine:
+    return lexer.parse(raw_msg)
@@ -1,25 +1,90 @@
+import asyncio
+import bisect
 import datetime
-from typing import List, Optional
+import os
+import re
+from pathlib import Path
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
 
 from systemhud.streams import capture
+from systemhud.watch import FileWatcher
 
 APT_FORMAT = "%S %m\n"
+DATE_FORMAT = "%m/%d/%Y"
+# calcurse prefers the legacy directory if it exists, then the XDG one
+DATA_DIRS = [
+    Path.home() / ".calcurse",
+    Path(os.environ.get("XDG_DATA_HOME", str(Path.home() / ".local" / "share")))
+    / "calcurse",
+]
+# MM/DD/YYYY @ HH:MM -> MM/DD/YYYY @ HH:MM {recurrence} >note |description
+APPOINTMENT_LINE = re.compile(
+    r"^(?P<start>\d\d/\d\d/\d{4} @ \d\d:\d\d) -> "
+    r"(?P<end>\d\d/\d\d/\d{4} @ \d\d:\d\d)\s*"
+    r"(?:\{(?P<recur>[^}]*)\}\s*)?(?:>\S+\s)?[|!](?P<name>.*)$"
+)
+# MM/DD/YYYY [ID] {recurrence} >note description
+EVENT_LINE = re.compile(
+    r"^(?P<date>\d\d/\d\d/\d{4}) \[\d+\]\s*"
+    r"(?:\{(?P<recur>[^}]*)\}\s*)?(?:>\S+\s)?(?P<name>.*)$"
+)
+# 1W -> MM/DD/YYYY !MM/DD/YYYY ..., anything else (newer extended rules) is
+# ignored
+RECURRENCE = re.compile(
+    r"^(?P<interval>\d+)(?P<freq>[DWMY])"
+    r"(?: -> (?P<until>\d\d/\d\d/\d{4}))?(?P<rest>.*)$"
+)
+EXCEPTION = re.compile(r"!(\d\d/\d\d/\d{4})")
+# longest the phase scheduler sleeps in one go, so it catches up after a
+# suspend (which the monotonic clock doesn't see) or a date rollover
+MAX_PHASE_SLEEP = 60
 
 
 class Appointment:
     name: str
     start: datetime.datetime
+    end: datetime.datetime
+    all_day: bool
     FULL_DAY_FMT = "..:.."
 
     def __init__(self, date: datetime.date, event: str):
         time, name = event.split(" ", 1)
         self.name = name
-        if time == self.FULL_DAY_FMT:
+        self.all_day = time == self.FULL_DAY_FMT
+        if self.all_day:
             time = "00:00"
         self.start = datetime.datetime.combine(
             date,
             datetime.datetime.strptime(time, "%H:%M").time(),
         )
+        self.end = self.start
+
+    @classmethod
+    def at(
+        cls,
+        start: datetime.datetime,
+        name: str,
+        end: Optional[datetime.datetime] = None,
+        all_day: bool = False,
+    ) -> "Appointment":
+        appointment = cls.__new__(cls)
+        appointment.name = name
+        appointment.start = start
+        appointment.end = end or start
+        appointment.all_day = all_day
+        return appointment
 
     def __repr__(self) -> str:
         return f"<{self.__class__.__name__} {self.start} - {self.name}>"
@@ -31,7 +96,248 @@ class Appointment:
 max_appointment = Appointment(datetime.date.max, "00:00 MAX FUTURE")
 
 
+def _add_months(
+    d: datetime.datetime, months: int
+) -> Optional[datetime.datetime]:
+    year, month = divmod(d.month - 1 + months, 12)
+    try:
+        return d.replace(year=d.year + year, month=month + 1)
+    except ValueError:
+        # i.e. the 31st in a shorter month, calcurse skips those as well
+        return None
+
+
+def recurrences(
+    start: datetime.datetime,
+    freq: str,
+    interval: int,
+    window_start: datetime.datetime,
+    window_end: datetime.datetime,
+    until: Optional[datetime.date] = None,
+    occurrences: Optional[int] = None,
+) -> Iterator[datetime.datetime]:
+    """Yields the starts of a repeating item (`freq` being one of D, W, M, Y)
+    that fall within [window_start, window_end).  Rather than walking from
+    the first occurrence, it jumps straight to the window, so long running
+    repeats cost the same as new ones."""
+    interval = max(interval, 1)
+    if freq in "DW":
+        step = datetime.timedelta(days=interval * (7 if freq == "W" else 1))
+        n = max((window_start - start) // step, 0)
+
+        def nth(i: int) -> Optional[datetime.datetime]:
+            return start + step * i
+
+    else:
+        months = interval * (12 if freq == "Y" else 1)
+        elapsed = (window_start.year - start.year) * 12 + (
+            window_start.month - start.month
+        )
+        n = max(elapsed // months - 1, 0)
+
+        def nth(i: int) -> Optional[datetime.datetime]:
+            return _add_months(start, months * i)
+
+    while occurrences is None or n < occurrences:
+        occurrence = nth(n)
+        n += 1
+        if occurrence is None:
+            continue
+        if occurrence >= window_end:
+            break
+        if until is not None and occurrence.date() > until:
+            break
+        if occurrence >= window_start:
+            yield occurrence
+
+
+class Item(NamedTuple):
+    """A single (possibly repeating) entry, before expansion."""
+
+    name: str
+    start: datetime.datetime
+    duration: datetime.timedelta
+    all_day: bool = False
+    freq: Optional[str] = None
+    interval: int = 1
+    until: Optional[datetime.date] = None
+    exceptions: FrozenSet[datetime.date] = frozenset()
+    # how many times it repeats in all, `until` being the other bound
+    occurrences: Optional[int] = None
+    # times are local unless this is set, zoned repeats are expanded in their
+    # own timezone so they follow its DST changes
+    tz: Optional[datetime.tzinfo] = None
+
+    def _local(self, t: datetime.datetime) -> datetime.datetime:
+        if self.tz is None:
+            return t
+        return t.replace(tzinfo=self.tz).astimezone().replace(tzinfo=None)
+
+    def expand(
+        self, window_start: datetime.datetime, window_end: datetime.datetime
+    ) -> Iterator[Appointment]:
+        # look back far enough to catch occurrences still running at the
+        # start of the window, with a day of slack for the timezone offset
+        slack = datetime.timedelta(days=1 if self.tz else 0)
+        search_start = window_start - self.duration - slack
+        if self.freq is None:
+            starts: Iterator[datetime.datetime] = iter([self.start])
+        else:
+            starts = recurrences(
+                self.start,
+                self.freq,
+                self.interval,
+                search_start,
+                window_end + slack,
+                until=self.until,
+                occurrences=self.occurrences,
+            )
+
+        for start in starts:
+            if start.date() in self.exceptions:
+                continue
+            start, end = self._local(start), self._local(start + self.duration)
+            if start >= window_end:
+                continue
+            if end < window_start or (end == window_start and self.duration):
+                continue
+            yield Appointment.at(start, self.name, end, self.all_day)
+
+
+def _parse_recurrence(raw: Optional[str]) -> dict:
+    if not raw:
+        return {}
+
+    match = RECURRENCE.match(raw.strip())
+    if not match:
+        return {}
+
+    until = match.group("until")
+    return {
+        "freq": match.group("freq"),
+        "interval": int(match.group("interval")),
+        "until": (
+            datetime.datetime.strptime(until, DATE_FORMAT).date()
+            if until
+            else None
+        ),
+        "exceptions": frozenset(
+            datetime.datetime.strptime(d, DATE_FORMAT).date()
+            for d in EXCEPTION.findall(match.group("rest"))
+        ),
+    }
+
+
+def parse_line(line: str) -> Optional[Item]:
+    match = APPOINTMENT_LINE.match(line)
+    if match:
+        start = datetime.datetime.strptime(
+            match.group("start"), f"{DATE_FORMAT} @ %H:%M"
+        )
+        end = datetime.datetime.strptime(
+            match.group("end"), f"{DATE_FORMAT} @ %H:%M"
+        )
+        return Item(
+            match.group("name"),
+            start,
+            end - start,
+            **_parse_recurrence(match.group("recur")),
+        )
+
+    match = EVENT_LINE.match(line)
+    if match:
+        return Item(
+            match.group("name"),
+            datetime.datetime.strptime(match.group("date"), DATE_FORMAT),
+            datetime.timedelta(days=1),
+            all_day=True,
+            **_parse_recurrence(match.group("recur")),
+        )
+
+    return None
+
+
+class AptsFile:
+    """Reads calcurse's `apts` data file directly instead of going through
+    `calcurse -Q`.  The parsed items are kept until the file changes, which
+    is checked through an inotify watch (see `check`), so a refresh only
+    costs a re-parse when there was an actual edit."""
+
+    def __init__(self, path: Optional[Path] = None):
+        if path is None:
+            data_dir = next((d for d in DATA_DIRS if d.is_dir()), DATA_DIRS[-1])
+            path = data_dir / "apts"
+        self.path = path
+        self.items: List[Item] = []
+        self.version = 0
+        self._watcher: Optional[FileWatcher] = None
+        self._parsed_generation = 0
+
+    @property
+    def available(self) -> bool:
+        return self.path.is_file()
+
+    def _parse(self) -> None:
+        items: List[Item] = []
+        with self.path.open() as apts:
+            for line in apts:
+                item = parse_line(line.rstrip("\n"))
+                if item is not None:
+                    items.append(item)
+
+        self.items = items
+        self.version += 1
+
+    def check(self) -> bool:
+        """Re-parses the file if it changed since the last check, returns
+        True if it did."""
+        if self._watcher is None:
+            self._watcher = FileWatcher(self.path)
+            self._parse()
+            return True
+
+        self._watcher.changed()
+        if self._watcher.generation == self._parsed_generation:
+            return False
+
+        self._parsed_generation = self._watcher.generation
+        self._parse()
+        return True
+
+    async def wait(self) -> None:
+        """Returns once the file changed, with the new contents parsed."""
+        self.check()
+        assert self._watcher is not None
+        await self._watcher.wait()
+        self.check()
+
+    def appointments(
+        self,
+        window_start: datetime.datetime,
+        window_end: datetime.datetime,
+    ) -> List[Appointment]:
+        self.check()
+        return sorted(
+            (
+                appointment
+                for item in self.items
+                for appointment in item.expand(window_start, window_end)
+            ),
+            key=lambda a: a.start,
+        )
+
+
+apts = AptsFile()
+
+
 async def get_appointments(days: int = 1) -> List[Appointment]:
+    if apts.available:
+        today = datetime.datetime.combine(
+            datetime.date.today(), datetime.time()
+        )
+        return apts.appointments(today, today + datetime.timedelta(days=days))
+
+    # no data file to read, fall back to asking calcurse
     date: Optional[datetime.date] = None
     appointments: List[Appointment] = []
 
@@ -46,3 +352,111 @@ async def get_appointments(days: int = 1) -> List[Appointment]:
             appointments.append(Appointment(date, line))
 
     return appointments
+
+
+class AppointmentIndex:
+    """Appointments sorted by start, so lookups by time are a bisect instead
+    of a scan over the whole list."""
+
+    def __init__(self, appointments: Iterable[Appointment]):
+        self.appointments = sorted(appointments, key=lambda a: a.start)
+        self.starts = [a.start for a in self.appointments]
+        # bounds how far back an appointment overlapping a time can start
+        self.max_duration = max(
+            (a.end - a.start for a in self.appointments),
+            default=datetime.timedelta(0),
+        )
+
+    def __len__(self) -> int:
+        return len(self.appointments)
+
+    def __iter__(self) -> Iterator[Appointment]:
+        return iter(self.appointments)
+
+    def next_after(self, t: datetime.datetime) -> Optional[Appointment]:
+        """The first appointment starting after `t`."""
+        i = bisect.bisect_right(self.starts, t)
+        return self.appointments[i] if i < len(self.appointments) else None
+
+    def overlapping(self, t: datetime.datetime) -> List[Appointment]:
+        """Appointments that have started but not yet ended at `t`."""
+        lo = bisect.bisect_left(self.starts, t - self.max_duration)
+        hi = bisect.bisect_right(self.starts, t)
+        return [a for a in self.appointments[lo:hi] if a.end > t]
+
+
+Transition = Tuple[Optional[Appointment], int]
+
+
+class PhaseScheduler:
+    """Follows the upcoming appointment through its `phases`, offsets before
+    the start in descending order (a negative one being after the start).
+    The phase is the number of offsets already crossed, once all of them are
+    the next appointment is picked up.
+
+    Instead of checking every tick, the exact instant of the next boundary is
+    computed and slept until, `changed` (i.e. `AptsFile.wait`) wakes it up
+    early when the appointments themselves changed.
+    """
+
+    def __init__(
+        self,
+        phases: Sequence[datetime.timedelta],
+        load: Callable[[], Awaitable[AppointmentIndex]],
+        changed: Optional[Callable[[], Awaitable[None]]] = None,
+    ):
+        self.phases = phases
+        self.load = load
+        self.changed = changed
+
+    def phase(self, appointment: Appointment, t: datetime.datetime) -> int:
+        time_until = appointment.start - t
+        return sum(1 for phase in self.phases if time_until <= phase)
+
+    def next_boundary(
+        self, appointment: Appointment, t: datetime.datetime
+    ) -> Optional[datetime.datetime]:
+        for phase in self.phases:
+            boundary = appointment.start - phase
+            if boundary > t:
+                return boundary
+        return None
+
+    async def _sleep(self, seconds: float) -> None:
+        seconds = min(max(seconds, 0), MAX_PHASE_SLEEP)
+        if self.changed is None:
+            await asyncio.sleep(seconds)
+            return
+
+        try:
+            await asyncio.wait_for(self.changed(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def transitions(self) -> AsyncIterator[Transition]:
+        """Yields the upcoming appointment and its phase, every time either
+        of them changes."""
+        last: Optional[Tuple[object, int]] = None
+        while True:
+            now = datetime.datetime.now()
+            index = await self.load()
+            # still within its last phase until that boundary is crossed
+            appointment = index.next_after(now + self.phases[-1])
+            phase = self.phase(appointment, now) if appointment else 0
+            # reloading creates new instances of the same appointments
+            state = (
+                (appointment.start, appointment.name) if appointment else None,
+                phase,
+            )
+            if state != last:
+                last = state
+                yield appointment, phase
+
+            boundary = (
+                self.next_boundary(appointment, now) if appointment else None
+            )
+            await self._sleep(
+                (boundary - now).total_seconds()
+                if boundary is not None
+                else MAX_PHASE_SLEEP
+            )
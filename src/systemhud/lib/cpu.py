@@ -2,7 +2,11 @@ from dataclasses import dataclass
 from os import cpu_count
 from typing import Sequence
 
+from systemhud.timeseries import Series
+
 PROC_STAT = "/proc/stat"
+# overall usage (percent) of every updating read
+history = Series("cpu")
 
 
 @dataclass
@@ -90,5 +94,6 @@ def diffs(update: bool = False) -> Sequence[CPUDiff]:
 
     if update:
         CHECKPOINT = new_checkpoint
+        history.append([diffs[0].usage_percent * 100])
 
     return diffs
@@ -0,0 +1,352 @@
+import datetime
+import logging
+import re
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from systemhud.lib.calcurse import Appointment, Item
+
+logger = logging.getLogger(__name__)
+
+FREQUENCIES = {"DAILY": "D", "WEEKLY": "W", "MONTHLY": "M", "YEARLY": "Y"}
+WEEKDAYS = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
+# rule parts that narrow the occurrences beyond what `calcurse.recurrences`
+# knows, events using them only show up on their first occurrence
+UNSUPPORTED_RULE_PARTS = {
+    "BYSECOND",
+    "BYMINUTE",
+    "BYHOUR",
+    "BYMONTHDAY",
+    "BYYEARDAY",
+    "BYWEEKNO",
+    "BYMONTH",
+    "BYSETPOS",
+}
+DURATION = re.compile(
+    r"^(?P<sign>[+-])?P(?:(?P<weeks>\d+)W)?(?:(?P<days>\d+)D)?"
+    r"(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>\d+)S)?)?$"
+)
+TEXT_ESCAPES = re.compile(r"\\([\\;,nN])")
+
+Property = Tuple[str, Dict[str, str], str]
+
+
+def unfold(lines: Iterable[str]) -> Iterator[str]:
+    """Joins the continuation lines (starting with whitespace) back onto the
+    content line they belong to."""
+    current: Optional[str] = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+
+    if current is not None:
+        yield current
+
+
+def parse_property(line: str) -> Optional[Property]:
+    head, sep, value = line.partition(":")
+    if not sep:
+        return None
+
+    name, *raw_params = head.split(";")
+    params = {}
+    for param in raw_params:
+        key, _, param_value = param.partition("=")
+        params[key.upper()] = param_value.strip('"')
+
+    return name.upper(), params, value
+
+
+def _timezone(name: str) -> Optional[datetime.tzinfo]:
+    try:
+        from zoneinfo import ZoneInfo  # type: ignore
+    except ImportError:
+        return None
+
+    try:
+        return ZoneInfo(name)
+    except (KeyError, ValueError, OSError):
+        # an unknown zone raises a ZoneInfoNotFoundError (a KeyError)
+        return None
+
+
+def parse_datetime(
+    value: str, params: Dict[str, str]
+) -> Tuple[datetime.datetime, bool, Optional[datetime.tzinfo]]:
+    """Returns the time as written, whether it was a whole day and the
+    timezone it is in (None being local time)."""
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        return datetime.datetime.strptime(value[:8], "%Y%m%d"), True, None
+
+    parsed = datetime.datetime.strptime(value[:15], "%Y%m%dT%H%M%S")
+    if value.endswith("Z"):
+        return parsed, False, datetime.timezone.utc
+    if "TZID" in params:
+        # without a timezone database these are taken as local time
+        return parsed, False, _timezone(params["TZID"])
+    return parsed, False, None
+
+
+def convert(
+    t: datetime.datetime,
+    source: Optional[datetime.tzinfo],
+    target: Optional[datetime.tzinfo],
+) -> datetime.datetime:
+    if source is target:
+        return t
+    return t.replace(tzinfo=source).astimezone(target).replace(tzinfo=None)
+
+
+def parse_duration(value: str) -> Optional[datetime.timedelta]:
+    match = DURATION.match(value)
+    if not match:
+        return None
+
+    duration = datetime.timedelta(
+        weeks=int(match.group("weeks") or 0),
+        days=int(match.group("days") or 0),
+        hours=int(match.group("hours") or 0),
+        minutes=int(match.group("minutes") or 0),
+        seconds=int(match.group("seconds") or 0),
+    )
+    return -duration if match.group("sign") == "-" else duration
+
+
+def unescape(text: str) -> str:
+    return TEXT_ESCAPES.sub(
+        lambda m: "\n" if m.group(1) in "nN" else m.group(1), text
+    )
+
+
+class Event:
+    """The parts of a `VEVENT` needed to place it on the calendar."""
+
+    def __init__(self, properties: List[Property]):
+        self.uid = ""
+        self.summary = ""
+        self.start: Optional[datetime.datetime] = None
+        self.tz: Optional[datetime.tzinfo] = None
+        self.end: Optional[datetime.datetime] = None
+        self.duration: Optional[datetime.timedelta] = None
+        self.all_day = False
+        self.rule: Dict[str, str] = {}
+        self.exdates: List[datetime.date] = []
+        self.recurrence_id: Optional[datetime.date] = None
+        self.cancelled = False
+
+        end_tz: Optional[datetime.tzinfo] = None
+        for name, params, value in properties:
+            if name == "UID":
+                self.uid = value
+            elif name == "SUMMARY":
+                self.summary = unescape(value)
+            elif name == "DTSTART":
+                self.start, self.all_day, self.tz = parse_datetime(
+                    value, params
+                )
+            elif name == "DTEND":
+                self.end, _, end_tz = parse_datetime(value, params)
+            elif name == "DURATION":
+                self.duration = parse_duration(value)
+            elif name == "RRULE":
+                self.rule = dict(
+                    part.partition("=")[::2] for part in value.split(";")
+                )
+            elif name == "EXDATE":
+                self.exdates += [
+                    parse_datetime(exdate, params)[0].date()
+                    for exdate in value.split(",")
+                ]
+            elif name == "RECURRENCE-ID":
+                self.recurrence_id = parse_datetime(value, params)[0].date()
+            elif name == "STATUS":
+                self.cancelled = value.upper() == "CANCELLED"
+
+        if self.end is not None:
+            self.end = convert(self.end, end_tz, self.tz)
+
+    def items(self) -> List[Item]:
+        assert self.start is not None
+        if self.end is not None:
+            duration = self.end - self.start
+        elif self.duration is not None:
+            duration = self.duration
+        else:
+            duration = datetime.timedelta(days=1 if self.all_day else 0)
+
+        item = Item(
+            self.summary,
+            self.start,
+            duration,
+            all_day=self.all_day,
+            exceptions=frozenset(self.exdates),
+            tz=self.tz,
+        )
+        freq = FREQUENCIES.get(self.rule.get("FREQ", ""))
+        if freq is None or UNSUPPORTED_RULE_PARTS & self.rule.keys():
+            return [item]
+
+        until: Optional[datetime.date] = None
+        if "UNTIL" in self.rule:
+            until = parse_datetime(self.rule["UNTIL"], {})[0].date()
+        occurrences = int(self.rule["COUNT"]) if "COUNT" in self.rule else None
+        item = item._replace(
+            freq=freq,
+            interval=int(self.rule.get("INTERVAL", 1)),
+            until=until,
+            occurrences=occurrences,
+        )
+
+        if "BYDAY" not in self.rule:
+            return [item]
+
+        weekdays = sorted(
+            {
+                WEEKDAYS.index(day[-2:])
+                for day in self.rule["BYDAY"].split(",")
+                if day[-2:] in WEEKDAYS
+            }
+        )
+        if freq != "W" or not weekdays:
+            # i.e. "the 2nd tuesday of the month", not supported
+            return [item._replace(freq=None)]
+
+        return self._split_weekdays(item, weekdays)
+
+    def _split_weekdays(self, item: Item, weekdays: List[int]) -> List[Item]:
+        # A weekly rule over several days is expanded as one weekly repeat
+        # per day, a count (over all of the days) becomes the date of the
+        # last occurrence
+        offsets = sorted((day - item.start.weekday()) % 7 for day in weekdays)
+        until = item.until
+        if item.occurrences is not None:
+            week, nth = divmod(item.occurrences - 1, len(offsets))
+            last = item.start + datetime.timedelta(
+                days=week * item.interval * 7 + offsets[nth]
+            )
+            until = min(until, last.date()) if until else last.date()
+
+        return [
+            item._replace(
+                start=item.start + datetime.timedelta(days=offset),
+                until=until,
+                occurrences=None,
+            )
+            for offset in offsets
+        ]
+
+
+def parse_events(lines: Iterable[str]) -> List[Item]:
+    events: List[Event] = []
+    properties: Optional[List[Property]] = None
+    depth = 0
+    for line in unfold(lines):
+        if line == "BEGIN:VEVENT":
+            properties, depth = [], 0
+        elif properties is None:
+            continue
+        elif line == "END:VEVENT":
+            events.append(Event(properties))
+            properties = None
+        elif line.startswith("BEGIN:"):
+            # nested components (alarms) have their own DTSTART and such
+            depth += 1
+        elif line.startswith("END:"):
+            depth -= 1
+        elif not depth:
+            prop = parse_property(line)
+            if prop is not None:
+                properties.append(prop)
+
+    # modified (or cancelled) instances replace that date of their series
+    overrides: Dict[str, List[datetime.date]] = {}
+    for event in events:
+        if event.recurrence_id is not None:
+            overrides.setdefault(event.uid, []).append(event.recurrence_id)
+
+    items: List[Item] = []
+    for event in events:
+        if event.start is None:
+            continue
+        if event.recurrence_id is None and event.uid in overrides:
+            event.exdates += overrides[event.uid]
+        if not event.cancelled:
+            items += event.items()
+
+    return items
+
+
+class IcsSource:
+    """Appointments from local `.ics` files, `paths` being either files or
+    (vdir style) directories of them.  Files are only re-parsed when their
+    mtime or size changed and only the parsed series are kept, occurrences
+    are expanded for the requested window, so long running calendars don't
+    cost more on every refresh."""
+
+    def __init__(self, paths: Iterable[Path]):
+        self.paths = list(paths)
+        self.version = 0
+        self._files: Dict[Path, Tuple[Tuple[int, int], List[Item]]] = {}
+
+    def _files_on_disk(self) -> Iterator[Path]:
+        for path in self.paths:
+            if path.is_dir():
+                yield from sorted(path.glob("*.ics"))
+            elif path.is_file():
+                yield path
+
+    def refresh(self) -> bool:
+        """Re-parses whatever changed since the last refresh, returns True if
+        anything did."""
+        files: Dict[Path, Tuple[Tuple[int, int], List[Item]]] = {}
+        changed = False
+        for ics in self._files_on_disk():
+            try:
+                stat = ics.stat()
+            except OSError:
+                continue
+
+            key = (stat.st_mtime_ns, stat.st_size)
+            cached = self._files.get(ics)
+            if cached is not None and cached[0] == key:
+                files[ics] = cached
+                continue
+
+            try:
+                with ics.open(encoding="utf-8", errors="replace") as f:
+                    files[ics] = (key, parse_events(f))
+            except OSError:
+                continue
+            except ValueError as e:
+                # i.e. a bad DTSTART or COUNT, the file is left out (until
+                # it changes again) rather than failing every refresh
+                logger.warning("skipping %s: %s", ics, e)
+                files[ics] = (key, [])
+            changed = True
+
+        changed = changed or files.keys() != self._files.keys()
+        self._files = files
+        if changed:
+            self.version += 1
+        return changed
+
+    def appointments(
+        self,
+        window_start: datetime.datetime,
+        window_end: datetime.datetime,
+    ) -> List[Appointment]:
+        self.refresh()
+        return sorted(
+            (
+                appointment
+                for _, items in self._files.values()
+                for item in items
+                for appointment in item.expand(window_start, window_end)
+            ),
+            key=lambda a: a.start,
+        )
@@ -1,6 +1,11 @@
 from dataclasses import dataclass
 from pathlib import Path
 
+from systemhud.timeseries import Series
+
+# percent used, at every update
+history = Series("memory")
+
 
 class Memory:
     PROC_MEMINFO = Path("/proc/meminfo")
@@ -27,6 +32,8 @@ class Memory:
                 elif k == "Cached":
                     self.cached = v
 
+        history.append([self.perc_used * 100])
+
     @property
     def used(self) -> int:
         return self.total - self.free
@@ -1,24 +1,50 @@
+import asyncio
 import hashlib
-import shutil
+import io
+import os
+import tempfile
+import time
 import urllib.request as urllib
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
-from typing import AsyncGenerator, NamedTuple, Optional, Tuple
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
 
-from systemhud.streams import Stream, capture
+from systemhud import dbus
+from systemhud.errors import DBusError
+from systemhud.streams import capture
 from systemhud.util import ReversableEnum
 
-STATUS_STREAM_CMD = (
-    "/usr/bin/playerctl -a -F metadata -f '{{lc(status)}}\1{{playerName}}'"
-)
-MPRIS_PLAYER_METADATA_FORMAT = (
-    "{{artist}}\1{{album}}\1{{title}}\1{{mpris:artUrl}}"
+# One follower for every player, records are `\1` separated fields that
+# `Players.feed` demultiplexes by player name
+FOLLOW_CMD = (
+    "/usr/bin/playerctl -a -F metadata -f '"
+    "{{playerName}}\1{{lc(status)}}\1"
+    "{{artist}}\1{{album}}\1{{title}}\1{{mpris:artUrl}}\1{{mpris:length}}'"
 )
+ALBUM_ART_DIR = Path("/tmp/albumart")
+ALBUM_ART_MAX_BYTES = 32 * 1024 * 1024
+# edge length (px) art is shrunk to, that's all a notification will show
+ALBUM_ART_SIZE = 256
+ALBUM_ART_FETCH_TIMEOUT = 10
+# players are `org.mpris.MediaPlayer2.<player name>` on the session bus
+MPRIS_PREFIX = "org.mpris.MediaPlayer2."
+MPRIS_PATH = "/org/mpris/MediaPlayer2"
+MPRIS_PLAYER = "org.mpris.MediaPlayer2.Player"
 
 
 class Status(ReversableEnum):
     PLAYING = "playing"
     PAUSED = "paused"
+    STOPPED = "stopped"
     UNKNOWN = "<unknown>"
 
 
@@ -27,6 +53,8 @@ class Track(NamedTuple):
     title: str
     album: Optional[str]
     art: Optional[str]
+    # in seconds
+    length: Optional[float] = None
 
     def __str__(self) -> str:
         if self.artist == "None":
@@ -35,97 +63,390 @@ class Track(NamedTuple):
         return f"{self.artist} - {self.title}"
 
 
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    if minutes >= 60:
+        return f"{minutes // 60}:{minutes % 60:02}:{seconds:02}"
+    return f"{minutes}:{seconds:02}"
+
+
 class Player:
-    proc: Optional[Stream]
+    """A single MPRIS player.  The playback position is only synced when the
+    player says something happened (status/track change or a seek) and is
+    otherwise extrapolated from the last sync, so showing progress doesn't
+    require polling the player.
+    """
 
-    def __init__(self, name: str, status: Status):
+    track: Optional[Track]
+
+    def __init__(self, name: str, status: Status = Status.UNKNOWN):
         self.name = name
         self._status = status
-        self.proc = None
+        self.track = None
         self.last_updated = datetime.now()
+        self._position = 0.0
+        self._position_at = time.monotonic()
 
-    def is_active(self) -> bool:
-        return self.status is Status.PLAYING
+    @property
+    def length(self) -> Optional[float]:
+        return self.track.length if self.track else None
 
     @property
-    def status_cmd(self) -> str:
-        return (
-            f"/usr/bin/playerctl --player={self.name} -F metadata "
-            f"-f '{MPRIS_PLAYER_METADATA_FORMAT}'"
-        )
+    def position(self) -> float:
+        position = self._position
+        if self._status is Status.PLAYING:
+            position += time.monotonic() - self._position_at
+
+        if self.length is not None:
+            return min(position, self.length)
+        return position
+
+    @property
+    def progress(self) -> Optional[float]:
+        if not self.length:
+            return None
+        return self.position / self.length
 
-    async def refresh_status(self) -> Status:
-        new_status = Status.rlookup(
-            (await capture(f"/usr/bin/playerctl --player={self.name} status"))[
-                0
-            ]
+    def sync_position(self, position: float) -> None:
+        self._position = position
+        self._position_at = time.monotonic()
+
+    def seeked(self, position: float) -> None:
+        self.sync_position(position)
+
+    async def resync_position(self) -> None:
+        """Asks the player for its authoritative position, only meant to be
+        used on events (i.e. a status change), never on a timer."""
+        output = await capture(
+            f"/usr/bin/playerctl --player={self.name} position"
         )
-        assert isinstance(new_status, Status)
-        self._status = new_status
-        return self.status
+        try:
+            self.sync_position(float(output[0]))
+        except (IndexError, ValueError):
+            pass
+
+    def is_active(self) -> bool:
+        return self.status is Status.PLAYING
 
     @property
     def status(self) -> Status:
         return self._status
 
-    def stop(self) -> None:
-        if self.proc:
-            self.proc.cleanup()
-
-    async def status_stream(self) -> AsyncGenerator[Optional[Track], None]:
-        self.stream = Stream(self.status_cmd)
-        async for line in self.stream:
-            print(f"{self.name}: {line!r}")
-            if not line:
-                await self.refresh_status()
-                print(f"refreshing status: {self.name} - {self.status}")
-            yield parse_track_logline(line)
-
     def update(self, status: Status) -> bool:
         if status is self._status:
             return False
 
+        # settle the extrapolated position under the old status first
+        self.sync_position(self.position)
         self._status = status
         self.last_updated = datetime.now()
         return True
 
+    def update_track(self, track: Optional[Track]) -> bool:
+        if track is None or track == self.track:
+            return False
+
+        self.track = track
+        self.sync_position(0.0)
+        return True
+
     def __repr__(self) -> str:
         return f"<Player[{self.name}] {self.status.value}>"
 
 
-def parse_status_logline(raw_msg: str) -> Tuple[str, Optional[Status]]:
+def parse_follow_logline(
+    raw_msg: str,
+) -> Tuple[str, Optional[Status], Optional[Track]]:
     try:
-        raw_status, name = raw_msg.split("\1")
-        return name, Status.rlookup(raw_status)
+        name, raw_status, artist, album, title, art, length = raw_msg.split(
+            "\1", 6
+        )
     except ValueError:
-        return "", None
+        return "", None, None
 
+    return (
+        name,
+        Status.rlookup(raw_status),
+        Track(
+            artist=None if not artist else artist,
+            title=title,
+            album=None if not album else album,
+            art=None if not art else art,
+            # mpris lengths are in microseconds
+            length=int(length) / 1000000 if length.isdigit() else None,
+        )
+        if title
+        else None,
+    )
 
-def parse_track_logline(raw_msg: str) -> Optional[Track]:
-    if "\1" not in raw_msg:
-        return None
 
-    artist, album, title, art = raw_msg.split("\1", 3)
-    return Track(
-        artist=None if not artist else artist,
-        title=title,
-        album=None if not album else album,
-        art=None if not art else art,
-    )
+class Players:
+    """Tracks every MPRIS player from the single `FOLLOW_CMD` stream, so the
+    number of `playerctl` processes doesn't grow with the number of players
+    (browsers spawn plenty of short lived ones).  `factory` builds the
+    `Player` (or subclass) for names seen for the first time.
+    """
+
+    def __init__(self, factory: Callable[[str], Player] = Player):
+        self.factory = factory
+        self.players: Dict[str, Player] = {}
+        # unique bus names to player names, a unique name is never reused
+        self._owners: Dict[str, str] = {}
+
+    def feed(self, line: str) -> Optional[Tuple[Player, bool, bool]]:
+        """Applies a record from the follower, returns the player it was for
+        and whether its status and/or track changed."""
+        name, status, track = parse_follow_logline(line)
+        if not name:
+            return None
+
+        if name not in self.players:
+            self.players[name] = self.factory(name)
+
+        player = self.players[name]
+        status_changed = status is not None and player.update(status)
+        return player, status_changed, player.update_track(track)
 
+    async def _owner(self, bus: Any, sender: str) -> Optional[Player]:
+        if sender not in self._owners:
+            for name in self.players:
+                if name in self._owners.values():
+                    continue
+                try:
+                    (owner,) = await dbus.call(
+                        bus,
+                        dbus.DBUS_SERVICE,
+                        dbus.DBUS_PATH,
+                        dbus.DBUS_SERVICE,
+                        "GetNameOwner",
+                        "s",
+                        [MPRIS_PREFIX + name],
+                    )
+                except DBusError:
+                    continue
+                self._owners[owner] = name
 
-def get_album_art(url: str) -> Path:
-    img_hash = hashlib.sha256(url.encode()).hexdigest()
-    img = Path(f"/tmp/albumart/{img_hash}")
+        owned = self._owners.get(sender)
+        return self.players.get(owned) if owned is not None else None
 
-    if img.exists():
+    async def seeks(
+        self, bus_address: Optional[str] = None
+    ) -> AsyncIterator[Player]:
+        """Yields players as they seek, with their position resynced from
+        the `Seeked` signal, the one change the follower doesn't report.
+        Ends straight away without a session bus to listen on."""
+        signals: "asyncio.Queue[Any]" = asyncio.Queue()
+        try:
+            bus = await dbus.get_bus(dbus.SESSION, bus_address)
+            await dbus.subscribe(
+                bus,
+                signals.put_nowait,
+                type="signal",
+                path=MPRIS_PATH,
+                interface=MPRIS_PLAYER,
+                member="Seeked",
+            )
+        except Exception:
+            return
+
+        while True:
+            msg = await signals.get()
+            player = await self._owner(bus, msg.sender)
+            if player is None:
+                continue
+
+            # mpris positions are in microseconds
+            player.seeked(msg.body[0] / 1000000)
+            yield player
+
+    @property
+    def active(self) -> Optional[Player]:
+        """The player to show, preferring the most recently changed playing
+        one, then the most recently changed paused one."""
+        active_player: Optional[Player] = None
+        for p in self.players.values():
+            if active_player is None:
+                active_player = p
+            elif p.status is Status.PLAYING:
+                if active_player.status is not Status.PLAYING:
+                    active_player = p
+                elif p.last_updated > active_player.last_updated:
+                    active_player = p
+            elif active_player.status is not Status.PLAYING:
+                if p.status is active_player.status:
+                    active_player = (
+                        p
+                        if p.last_updated > active_player.last_updated
+                        else active_player
+                    )
+                elif p.status is Status.PAUSED:
+                    active_player = p
+
+        return active_player
+
+
+class AlbumArtCache:
+    """On disk cache of album art, downscaled to thumbnails.
+
+    Downloads (and `file://` reads) happen on a worker thread so a slow
+    server can't stall the bar, concurrent requests for the same url share
+    the one fetch, and images are written to a temporary file that is then
+    renamed into place so a failed fetch never leaves a half written (or
+    empty) entry behind.  The least recently used entries are evicted once
+    the cache grows past `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        path: Path = ALBUM_ART_DIR,
+        max_bytes: int = ALBUM_ART_MAX_BYTES,
+        size: int = ALBUM_ART_SIZE,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.size = size
+        self.total_bytes = 0
+        self._entries: "OrderedDict[Path, int]" = OrderedDict()
+        self._pending: Dict[str, "asyncio.Future[Optional[Path]]"] = {}
+        self._loading: Optional["asyncio.Future[None]"] = None
+        self._loaded = False
+
+    def _load(self) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for img in self.path.iterdir():
+            stat = img.stat()
+            # leftovers from interrupted fetches (or the old cache format)
+            if img.name.startswith(".") or not stat.st_size:
+                img.unlink()
+                continue
+            entries.append((stat.st_mtime, img, stat.st_size))
+
+        for _, img, img_size in sorted(entries):
+            self._entries[img] = img_size
+            self.total_bytes += img_size
+
+    def _fetch(self, url: str, img: Path) -> Optional[int]:
+        try:
+            with urllib.urlopen(
+                url, timeout=ALBUM_ART_FETCH_TIMEOUT
+            ) as img_request:
+                data = self._thumbnail(img_request.read())
+        except (OSError, ValueError):
+            return None
+
+        try:
+            fd, tmp_name = tempfile.mkstemp(dir=self.path, prefix=".")
+        except FileNotFoundError:
+            # cleaned out from under the cache (i.e. by a tmp cleaner)
+            try:
+                self.path.mkdir(parents=True, exist_ok=True)
+                fd, tmp_name = tempfile.mkstemp(dir=self.path, prefix=".")
+            except OSError:
+                return None
+        except OSError:
+            return None
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_name, img)
+        except OSError:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+            return None
+
+        return len(data)
+
+    def _thumbnail(self, data: bytes) -> bytes:
+        try:
+            from PIL import Image
+        except ImportError:
+            # without Pillow the art is just cached as is
+            return data
+
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                if max(image.size) <= self.size:
+                    return data
+
+                fmt = image.format or "PNG"
+                image.thumbnail((self.size, self.size))
+                out = io.BytesIO()
+                image.save(out, format=fmt)
+        except Exception:
+            # anything Pillow can't read or write back (it raises a
+            # KeyError for formats it has no writer for) is kept as is
+            return data
+
+        return out.getvalue()
+
+    def _evict(self) -> None:
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            img, img_size = self._entries.popitem(last=False)
+            self.total_bytes -= img_size
+            try:
+                img.unlink()
+            except FileNotFoundError:
+                pass
+
+    async def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+
+        if self._loading is None:
+            self._loading = asyncio.get_running_loop().run_in_executor(
+                None, self._load
+            )
+        loading = self._loading
+        try:
+            # shielded, a caller giving up doesn't stop the others' load
+            await asyncio.shield(loading)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # the next call tries again
+            if self._loading is loading:
+                self._loading = None
+            raise
+
+        self._loaded = True
+
+    async def _add(self, url: str, img: Path) -> Optional[Path]:
+        try:
+            img_size = await asyncio.get_running_loop().run_in_executor(
+                None, self._fetch, url, img
+            )
+        finally:
+            del self._pending[url]
+
+        if img_size is None:
+            return None
+
+        self._entries[img] = img_size
+        self.total_bytes += img_size
+        self._evict()
         return img
 
-    if not img.parent.is_dir():
-        img.parent.mkdir()
+    async def get(self, url: str) -> Optional[Path]:
+        await self._ensure_loaded()
+
+        img = self.path / hashlib.sha256(url.encode()).hexdigest()
+        if img in self._entries:
+            self._entries.move_to_end(img)
+            return img
+
+        # the fetch is a task of its own that every caller waits on, so one
+        # of them being cancelled doesn't cancel it for the rest
+        if url not in self._pending:
+            self._pending[url] = asyncio.ensure_future(self._add(url, img))
+        return await asyncio.shield(self._pending[url])
+
+
+album_art = AlbumArtCache()
 
-    img.touch()
-    with img.open("wb") as f, urllib.urlopen(url) as img_request:
-        shutil.copyfileobj(img_request, f)
 
-    return img
+async def get_album_art(url: str) -> Optional[Path]:
+    return await album_art.get(url)
@@ -1,12 +1,16 @@
 """
 Wrappers to give pulseaudio information a python interface
 """
+import asyncio
+import logging
 import re
 from typing import AsyncIterator, Dict, List, Optional, Set, Tuple, Union
 
 from systemhud.streams import capture, run
 from systemhud.util import ReversableEnum
 
+logger = logging.getLogger(__name__)
+
 SUBSCRIBE_REGEX = re.compile(
     r"^Event '(new|change|remove)' on "
     r"(client|sink|sink-input|source|source-output) #([0-9]+)$"
@@ -66,22 +70,22 @@ class Device:
             bv, _ = metadata["base volume"].split("/", 1)
             self._base = int(bv)
 
+    @property
+    def key(self) -> Tuple[Type, int]:
+        return self.device_type, self.device_id
+
     @property
     def volume(self) -> float:
         return 0.0 if self.muted else self._volume
 
     async def set_volume(self, percv: float) -> None:
-        if percv < 0:
-            percv = 0.0
+        volume_pipeline.set_volume(self, percv)
 
-        await run(
-            f"pacmd set-{self.device_type}-volume {self.device_id} "
-            f"{int(self._base * percv / 100)}"
-        )
+    async def adjust_volume(self, delta: float) -> None:
+        volume_pipeline.adjust_volume(self, delta)
 
     async def toggle_mute(self) -> None:
-        s = 0 if self.muted else 1
-        await run(f"pacmd set-{self.device_type}-mute {self.device_id} {s}")
+        volume_pipeline.toggle_mute(self)
 
     async def set_default(self) -> None:
         await run(f"pacmd set-default-{self.device_type} {self.device_id}")
@@ -115,6 +119,9 @@ class Devices:
 
             self.devices[device_id] = Device(self.device_type, device_id)
             self.devices[device_id].update(device_metadata)
+            # don't let a refresh that raced an unflushed command revert
+            # the optimistic state
+            volume_pipeline.overlay(self.devices[device_id])
 
         if set(self.devices) - found_ids:
             deleted_ids = set(self.devices) - found_ids
@@ -126,6 +133,97 @@ class Devices:
         return self.devices[self._default]
 
 
+class VolumePipeline:
+    """Coalesces volume and mute commands per device.
+
+    Every request is applied to the cached `Device` immediately, so the
+    icon and notification can be redrawn before pulseaudio catches up, and
+    the net result is sent as a single `pacmd` call per device once the
+    window closes.
+    """
+
+    WINDOW = 0.05
+
+    def __init__(self, window: float = WINDOW):
+        self.window = window
+        self._volumes: Dict[Tuple[Type, int], float] = {}
+        self._mutes: Dict[Tuple[Type, int], bool] = {}
+        self._devices: Dict[Tuple[Type, int], Device] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def set_volume(self, device: Device, percv: float) -> None:
+        percv = max(percv, 0.0)
+        device._volume = percv
+        self._volumes[device.key] = percv
+        self._schedule(device)
+
+    def adjust_volume(self, device: Device, delta: float) -> None:
+        # relative changes stack on top of whatever is still pending, not the
+        # last value pulseaudio reported
+        current = self._volumes.get(device.key, device._volume)
+        self.set_volume(device, current + delta)
+
+    def toggle_mute(self, device: Device) -> None:
+        device.muted = not self._mutes.get(device.key, device.muted)
+        self._mutes[device.key] = device.muted
+        self._schedule(device)
+
+    def overlay(self, device: Device) -> None:
+        if device.key in self._volumes:
+            device._volume = self._volumes[device.key]
+        if device.key in self._mutes:
+            device.muted = self._mutes[device.key]
+
+    def _schedule(self, device: Device) -> None:
+        self._devices[device.key] = device
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self) -> None:
+        # anything requested while a flush is in flight gets its own window
+        while self._devices:
+            await asyncio.sleep(self.window)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("applying volume changes failed")
+
+    async def flush(self) -> None:
+        devices, self._devices = self._devices, {}
+
+        commands: List[str] = []
+        for key, device in devices.items():
+            if key in self._volumes:
+                commands.append(
+                    f"pacmd set-{device.device_type}-volume "
+                    f"{device.device_id} "
+                    f"{int(device._base * self._volumes[key] / 100)}"
+                )
+            if key in self._mutes:
+                commands.append(
+                    f"pacmd set-{device.device_type}-mute "
+                    f"{device.device_id} {int(self._mutes[key])}"
+                )
+
+        try:
+            results = await asyncio.gather(*[run(cmd) for cmd in commands])
+        finally:
+            # the pending values are kept as an overlay until the commands
+            # land (or fail), unless the device was touched again in the
+            # meantime
+            for key in devices:
+                if key not in self._devices:
+                    self._volumes.pop(key, None)
+                    self._mutes.pop(key, None)
+
+        for cmd, ok in zip(commands, results):
+            if not ok:
+                logger.warning("%s failed", cmd)
+
+
+volume_pipeline = VolumePipeline()
+
+
 async def get_devices(
     t: Type,
 ) -> AsyncIterator[Dict[str, Union[str, int, bool]]]:
@@ -0,0 +1,156 @@
+"""
+What an applet spends its time on: how long each update handler takes and
+how often it renders, how late the loop wakes the timed updates and how
+much CPU the process has used.  Kept as plain counters (no wakeups of its
+own, they are written out when asked for) in the Prometheus text format,
+plus an optional sampling profiler for finding the hot code.
+"""
+import signal
+import time
+from bisect import bisect_left
+from collections import Counter
+from pathlib import Path
+from types import FrameType
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# upper bounds (in seconds) of the latency buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+PROFILE_INTERVAL = 0.005
+# frames kept per profiler sample, from the innermost
+PROFILE_DEPTH = 32
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = BUCKETS):
+        self.buckets = buckets
+        # the last one being everything past the largest bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+    def lines(self, name: str, labels: str) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines += [
+            f'{name}_bucket{{{labels},le="+Inf"}} {self.count}',
+            f"{name}_sum{{{labels}}} {self.total:.6f}",
+            f"{name}_count{{{labels}}} {self.count}",
+        ]
+        return lines
+
+
+class Metrics:
+    def __init__(self, applet: str):
+        self.applet = applet
+        self.latency: Dict[str, Histogram] = {}
+        self.renders: Counter = Counter()
+        # how late the loop woke the timed updates past their period
+        self.lag = Histogram()
+        self.tracked: Dict[str, Tuple[str, Callable[[], Dict[str, int]]]] = {}
+
+    def observe(self, handler: str, seconds: float, rendered: bool) -> None:
+        if handler not in self.latency:
+            self.latency[handler] = Histogram()
+        self.latency[handler].observe(seconds)
+        if rendered:
+            self.renders[handler] += 1
+
+    def track(
+        self, name: str, label: str, read: Callable[[], Dict[str, int]]
+    ) -> None:
+        """Adds counters kept elsewhere (i.e. by the notification
+        coalescer), `read` whenever the metrics are written out and each
+        count labelled with its key under `label`."""
+        self.tracked[name] = (label, read)
+
+    def _labels(self, handler: Optional[str] = None) -> str:
+        labels = f'applet="{self.applet}"'
+        return f'{labels},handler="{handler}"' if handler else labels
+
+    def prometheus(self) -> str:
+        lines = [
+            "# TYPE systemhud_cpu_seconds_total counter",
+            f"systemhud_cpu_seconds_total{{{self._labels()}}}"
+            f" {time.process_time():.3f}",
+            "# TYPE systemhud_loop_lag_seconds histogram",
+            *self.lag.lines("systemhud_loop_lag_seconds", self._labels()),
+            "# TYPE systemhud_handler_seconds histogram",
+        ]
+        for handler, histogram in sorted(self.latency.items()):
+            lines += histogram.lines(
+                "systemhud_handler_seconds", self._labels(handler)
+            )
+        lines.append("# TYPE systemhud_renders_total counter")
+        lines += [
+            f"systemhud_renders_total{{{self._labels(handler)}}} {count}"
+            for handler, count in sorted(self.renders.items())
+        ]
+        for name, (label, read) in sorted(self.tracked.items()):
+            lines.append(f"# TYPE {name} counter")
+            lines += [
+                f'{name}{{{self._labels()},{label}="{key}"}} {count}'
+                for key, count in sorted(read().items())
+            ]
+
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: Path) -> str:
+        # replaced whole, so a scrape never reads a partial file
+        text = self.prometheus()
+        partial = path.with_suffix(".tmp")
+        partial.write_text(text)
+        partial.replace(path)
+        return text
+
+
+class Profiler:
+    """Samples the running stack on every `interval` of CPU time used (so an
+    idle applet costs nothing) and counts the stacks seen, written out in
+    the folded format flame graph tools read.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.running = False
+
+    def _sample(self, signum: int, frame: Optional[FrameType]) -> None:
+        stack: List[str] = []
+        while frame is not None and len(stack) < PROFILE_DEPTH:
+            code = frame.f_code
+            stack.append(
+                f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+            )
+            frame = frame.f_back
+        self.samples[";".join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        if self.running or not hasattr(signal, "setitimer"):
+            return
+
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self.running = True
+
+    def stop(self) -> None:
+        if not self.running:
+            return
+
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        self.running = False
+
+    def folded(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.samples.most_common()
+        )
@@ -0,0 +1,42 @@
+from typing import Callable, Optional
+
+
+class AdaptivePeriod:
+    """The period of a timed update that stretches out while its results
+    keep rendering the same and drops back to `min_period` as soon as they
+    change, so flat readings cost fewer wakeups without changes showing up
+    late.  When given an `on_ac` check, the period is scaled up while on
+    battery, always kept within the `min_period` and `max_period` bounds.
+    """
+
+    STRETCH = 1.5
+    BATTERY_SCALE = 2.0
+
+    def __init__(
+        self,
+        period: float,
+        max_period: float,
+        min_period: Optional[float] = None,
+        on_ac: Optional[Callable[[], bool]] = None,
+    ):
+        self.min_period = period if min_period is None else min_period
+        self.max_period = max(max_period, self.min_period)
+        self.current = period
+        self.on_ac = on_ac
+        self._last: Optional[str] = None
+
+    def next(self, rendered: Optional[str]) -> float:
+        """How long to wait after a run that rendered `rendered` (None when
+        it had nothing new to show)."""
+        if rendered is not None and rendered != self._last:
+            self._last = rendered
+            self.current = self.min_period
+        else:
+            self.current = min(self.current * self.STRETCH, self.max_period)
+
+        scale = (
+            self.BATTERY_SCALE
+            if self.on_ac is not None and not self.on_ac()
+            else 1.0
+        )
+        return max(self.min_period, min(self.max_period, self.current * scale))
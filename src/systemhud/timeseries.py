@@ -0,0 +1,234 @@
+"""
+A history of readings (cpu usage, battery capacity, ...) that the applets
+already take, kept so their notifications can show trends rather than just
+the latest value.  Each series is a memory mapped file of fixed size ring
+buffers in `$XDG_RUNTIME_DIR`: one of the raw samples and ones of their
+per minute and per hour means.  Appending is a couple of struct packs into
+the mapping and readers (any process) unpack straight out of theirs, a
+sequence counter per ring tells them to retry if they raced a write.
+A series has a single writer, the applet taking its readings.
+"""
+import mmap
+import os
+import struct
+import time
+from enum import IntEnum
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+from systemhud.util import runtime_dir
+
+MAGIC = b"hudts001"
+# 10 minutes of 1s readings, a day of minutes and a week of hours, one ring
+# per `Resolution`
+CAPACITIES = (600, 24 * 60, 7 * 24)
+# magic, number of values per sample, then each ring's capacity
+HEADER = struct.Struct(f"<8sI{len(CAPACITIES)}I4x")
+# sequence (odd while being written), samples ever written
+RING_HEADER = struct.Struct("<QQ")
+READ_ATTEMPTS = 8
+
+Sample = Tuple[float, Tuple[float, ...]]
+
+
+class Resolution(IntEnum):
+    RAW = 0
+    MINUTE = 1
+    HOUR = 2
+
+    @property
+    def seconds(self) -> int:
+        return (0, 60, 3600)[self]
+
+
+class _Bucket:
+    """The running mean of the samples in the current minute (or hour)."""
+
+    def __init__(self, width: int):
+        self.start: Optional[float] = None
+        self.sums = [0.0] * width
+        self.count = 0
+
+    def add(self, start: float, values: Sequence[float]) -> None:
+        self.start = start
+        self.sums = [s + v for s, v in zip(self.sums, values)]
+        self.count += 1
+
+    def flush(self) -> Optional[Sample]:
+        if self.start is None or not self.count:
+            return None
+
+        sample = (self.start, tuple(s / self.count for s in self.sums))
+        self.start, self.sums, self.count = None, [0.0] * len(self.sums), 0
+        return sample
+
+
+class Series:
+    def __init__(
+        self,
+        name: str,
+        width: int = 1,
+        capacities: Sequence[int] = CAPACITIES,
+        path: Optional[Path] = None,
+    ):
+        if len(capacities) != len(CAPACITIES):
+            raise ValueError(
+                f"{name}: needs a capacity for each of the"
+                f" {len(CAPACITIES)} resolutions, got {len(capacities)}"
+            )
+        self.name = name
+        self.width = width
+        self.capacities = tuple(capacities)
+        self.path = path
+        self.sample = struct.Struct(f"<d{width}d")
+        self._map: Optional[mmap.mmap] = None
+        self._writable = False
+        self._buckets = [_Bucket(width) for _ in Resolution][1:]
+
+    @property
+    def size(self) -> int:
+        return HEADER.size + sum(
+            RING_HEADER.size + self.sample.size * capacity
+            for capacity in self.capacities
+        )
+
+    def _ring(self, resolution: Resolution) -> int:
+        return HEADER.size + sum(
+            RING_HEADER.size + self.sample.size * capacity
+            for capacity in self.capacities[:resolution]
+        )
+
+    def _open(self, write: bool) -> Optional[mmap.mmap]:
+        if self._map is not None and (self._writable or not write):
+            return self._map
+        if self.path is None:
+            self.path = runtime_dir() / "series" / f"{self.name}.ts"
+
+        header = HEADER.pack(MAGIC, self.width, *self.capacities)
+        if write:
+            self.path.parent.mkdir(mode=0o700, exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        else:
+            try:
+                fd = os.open(self.path, os.O_RDONLY)
+            except OSError:
+                return None
+
+        try:
+            if write and os.pread(fd, HEADER.size, 0) != header:
+                # new, or laid out differently, start over
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self.size)
+                os.pwrite(fd, header, 0)
+            elif os.fstat(fd).st_size != self.size:
+                return None
+            self._map = mmap.mmap(
+                fd,
+                self.size,
+                access=mmap.ACCESS_WRITE if write else mmap.ACCESS_READ,
+            )
+        finally:
+            os.close(fd)
+
+        if self._map[: HEADER.size] != header:
+            self._map = None
+            return None
+
+        self._writable = write
+        return self._map
+
+    def _push(self, resolution: Resolution, sample: Sample) -> None:
+        assert self._map is not None
+        ring = self._ring(resolution)
+        seq, written = RING_HEADER.unpack_from(self._map, ring)
+        RING_HEADER.pack_into(self._map, ring, seq + 1, written)
+        self.sample.pack_into(
+            self._map,
+            ring
+            + RING_HEADER.size
+            + (written % self.capacities[resolution]) * self.sample.size,
+            sample[0],
+            *sample[1],
+        )
+        RING_HEADER.pack_into(self._map, ring, seq + 2, written + 1)
+
+    def append(
+        self, values: Sequence[float], t: Optional[float] = None
+    ) -> None:
+        """Records a reading, rolling the minute and hour means over when it
+        lands past the current ones."""
+        if t is None:
+            t = time.time()
+        if self._open(write=True) is None:
+            return
+
+        self._push(Resolution.RAW, (t, tuple(values)))
+        for resolution, bucket in zip(
+            (Resolution.MINUTE, Resolution.HOUR), self._buckets
+        ):
+            start = t - t % resolution.seconds
+            if bucket.start is not None and bucket.start != start:
+                finished = bucket.flush()
+                if finished is not None:
+                    self._push(resolution, finished)
+            bucket.add(start, values)
+
+    def samples(
+        self,
+        resolution: Resolution = Resolution.RAW,
+        since: Optional[float] = None,
+    ) -> List[Sample]:
+        """The samples still in the ring (optionally only the ones from
+        `since` on), oldest first."""
+        table = self._open(write=self._writable)
+        if table is None:
+            return []
+
+        ring = self._ring(resolution)
+        capacity = self.capacities[resolution]
+        for attempt in range(READ_ATTEMPTS):
+            if attempt:
+                # raced a write, give the writer the CPU to finish it
+                time.sleep(0)
+            seq, written = RING_HEADER.unpack_from(table, ring)
+            if seq % 2:
+                continue
+
+            first = max(0, written - capacity)
+            samples = []
+            for n in range(first, written):
+                t, *values = self.sample.unpack_from(
+                    table,
+                    ring + RING_HEADER.size + (n % capacity) * self.sample.size,
+                )
+                if since is None or t >= since:
+                    samples.append((t, tuple(values)))
+
+            if RING_HEADER.unpack_from(table, ring)[0] == seq:
+                return samples
+
+        return []
+
+    def values(
+        self,
+        resolution: Resolution = Resolution.RAW,
+        since: Optional[float] = None,
+        field: int = 0,
+    ) -> List[float]:
+        return [values[field] for _, values in self.samples(resolution, since)]
+
+
+def rate(samples: Sequence[Sample], field: int = 0) -> Optional[float]:
+    """How fast (per hour) a value changed over the samples, through a
+    least squares fit."""
+    if len(samples) < 2:
+        return None
+
+    mean_t = sum(t for t, _ in samples) / len(samples)
+    mean_v = sum(v[field] for _, v in samples) / len(samples)
+    variance = sum((t - mean_t) ** 2 for t, _ in samples)
+    if not variance:
+        return None
+
+    covariance = sum((t - mean_t) * (v[field] - mean_v) for t, v in samples)
+    return covariance / variance * 3600
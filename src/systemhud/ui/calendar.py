@@ -1,57 +1,83 @@
+import calendar
 import datetime
-from typing import List, Sequence
+from functools import lru_cache
+from typing import AbstractSet, List, Sequence, Tuple
 
+from systemhud.ui.colors import Color
 from systemhud.ui.pango import wrapped
 
 SUNDAY = 6
+# date, then the cell as rendered normally, for today and when scheduled
+Cell = Tuple[datetime.date, str, str, str]
+Grid = Tuple[Tuple[Cell, ...], ...]
+ROW_WIDTH = 20
 
 
 class Calendar:
-    SCHEDULED = wrapped(foreground="00FFFF")
-    TODAY = wrapped(weight="bold", foreground="00FF00")
-    ACTIVE = wrapped(foreground="FFFFFF")
-    INACTIVE = wrapped(foreground="333333")
+    SCHEDULED = wrapped(foreground=Color("00FFFF"))
+    TODAY = wrapped(weight="bold", foreground=Color("00FF00"))
+    ACTIVE = wrapped(foreground=Color("FFFFFF"))
+    INACTIVE = wrapped(foreground=Color("333333"))
 
-    def __init__(self, date: datetime.datetime):
+    def __init__(self, date: datetime.datetime, months: int = 1):
         self.base = date
+        self.months = months
 
     @property
     def label(self) -> str:
         return self.base.strftime("%B")
 
-    def rows(self, schedule: Sequence[datetime.date] = []) -> Sequence[str]:
+    def _month_starts(self) -> List[datetime.date]:
+        starts = []
+        year, month = self.base.year, self.base.month
+        for _ in range(self.months):
+            starts.append(datetime.date(year, month, 1))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return starts
+
+    def rows(
+        self, schedule: AbstractSet[datetime.date] = frozenset()
+    ) -> Sequence[str]:
+        """The weeks of the month(s), the months after the first one are
+        preceded by their name."""
+        today = self.base.date()
         rows: List[str] = []
-        row = ""
-
-        first = datetime.date(self.base.year, self.base.month, 1)
-        # weekday() treats weeks to be [M...SUN], so we adjust, a month
-        # starting on a sunday ends up putting an empty week here, so we
-        # special case that
-        if first.weekday() == SUNDAY:
-            cursor = first
-        else:
-            # and then adjust the rest to be on the preceeding sunday
-            cursor = first - datetime.timedelta(days=first.weekday() + 1)
-        while True:
-            if cursor == self.base.date():
-                tag = Calendar.TODAY
-            elif cursor in schedule:
-                tag = Calendar.SCHEDULED
-            elif cursor.month != self.base.month:
-                tag = Calendar.INACTIVE
-            else:
-                tag = Calendar.ACTIVE
-            row += tag(f"{cursor.day:2}") + " "
-            cursor += datetime.timedelta(days=1)
-            if cursor.weekday() == SUNDAY:
-                rows.append(row.rstrip())
-                row = ""
-                if cursor.month != first.month:
-                    break
-            elif cursor < first:
-                continue
+        for i, first in enumerate(self._month_starts()):
+            if i:
+                rows.append(first.strftime("%B").center(ROW_WIDTH))
+            rows += [
+                " ".join(
+                    today_cell
+                    if date == today
+                    else scheduled_cell
+                    if date in schedule
+                    else cell
+                    for date, cell, today_cell, scheduled_cell in week
+                )
+                for week in month_grid(first.year, first.month)
+            ]
 
         return rows
 
     def __str__(self) -> str:
         return "\n".join(self.rows())
+
+
+@lru_cache(maxsize=12)
+def month_grid(year: int, month: int) -> Grid:
+    """The weeks (starting on sunday) covering the month, with every cell
+    already rendered in each of the ways it can be shown."""
+    return tuple(
+        tuple(
+            (
+                date,
+                (Calendar.ACTIVE if date.month == month else Calendar.INACTIVE)(
+                    f"{date.day:2}"
+                ),
+                Calendar.TODAY(f"{date.day:2}"),
+                Calendar.SCHEDULED(f"{date.day:2}"),
+            )
+            for date in week
+        )
+        for week in calendar.Calendar(SUNDAY).monthdatescalendar(year, month)
+    )
@@ -1,7 +1,12 @@
-from typing import Optional, Sequence, Tuple, Union
+import bisect
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
+RGBA = Tuple[int, int, int, float]
 
-def parse_color_str(src: str) -> Tuple[int, int, int, float]:
+
+@lru_cache(maxsize=None)
+def parse_color_str(src: str) -> RGBA:
     if len(src) in {3, 4}:
         src = "".join(c * 2 for c in src)
     elif len(src) not in {6, 8}:
@@ -29,40 +34,73 @@ def validate_color_value(*values: int) -> None:
 
 
 class Color:
-    HEX_STR_FORMAT = "{:02X}{:02X}{:02X}{:02X}"
+    """An immutable color, there is only ever one instance per RGBA value so
+    building one that already exists (i.e. `with_opacity` on every render)
+    is a dictionary lookup rather than a new object."""
 
-    def __init__(
-        self,
+    HEX_STR_FORMAT = "{:02X}{:02X}{:02X}{:02X}"
+    __slots__ = ("_red", "_green", "_blue", "_opacity", "_hex", "_opacities")
+    _interned: Dict[RGBA, "Color"] = {}
+
+    _red: int
+    _green: int
+    _blue: int
+    _opacity: float
+    _hex: str
+    _opacities: Optional[Tuple["Color", ...]]
+
+    def __new__(
+        cls,
         r_or_color: Union[str, int],
         g: Optional[int] = None,
         b: Optional[int] = None,
         o: float = 1.0,
-    ):
+    ) -> "Color":
         if isinstance(r_or_color, str):
-            self._red, self._green, self._blue, self._opacity = parse_color_str(
-                r_or_color
-            )
+            rgba = parse_color_str(r_or_color)
         elif g is None or b is None:
             raise ValueError(
                 "You must pass in a red, green, and blue value for a Color."
             )
         else:
-            self._red = r_or_color
-            self._green = g
-            self._blue = b
-            self._opacity = o
-
-        validate_color_value(self._red, self._green, self._blue)
-        assert self._opacity >= 0.0 and self._opacity <= 1.0, (
-            f"{self._opacity} is not within the valid opacity range "
-            "of [0.0,1.0]."
+            rgba = (r_or_color, g, b, o)
+
+        color = cls._interned.get(rgba)
+        if color is not None:
+            return color
+
+        r, g, b, o = rgba
+        validate_color_value(r, g, b)
+        assert o >= 0.0 and o <= 1.0, (
+            f"{o} is not within the valid opacity range of [0.0,1.0]."
         )
 
-    def __str__(self) -> str:
-        return self.HEX_STR_FORMAT.format(
-            int(self._opacity * 255), self._red, self._green, self._blue
+        color = super().__new__(cls)
+        for name, value in (
+            ("_red", r),
+            ("_green", g),
+            ("_blue", b),
+            ("_opacity", o),
+            ("_hex", cls.HEX_STR_FORMAT.format(int(o * 255), r, g, b)),
+            ("_opacities", None),
+        ):
+            object.__setattr__(color, name, value)
+
+        cls._interned[rgba] = color
+        return color
+
+    def __setattr__(self, name: str, value: object) -> None:
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __reduce__(self):
+        return (
+            self.__class__,
+            (self._red, self._green, self._blue, self._opacity),
         )
 
+    def __str__(self) -> str:
+        return self._hex
+
     def __repr__(self) -> str:
         return (
             f"<Color ({self._red},{self._green},{self._blue},{self._opacity})>"
@@ -76,23 +114,81 @@ class Color:
                 f"{new_opacity} is not within the valid range of [0, 100]"
             )
 
-        return Color(self._red, self._green, self._blue, new_opacity / 100.0)
+        # percentages are the common case, so they get built all at once
+        if self._opacities is None:
+            object.__setattr__(
+                self,
+                "_opacities",
+                tuple(
+                    Color(self._red, self._green, self._blue, i / 100.0)
+                    for i in range(101)
+                ),
+            )
+        assert self._opacities is not None
+        return self._opacities[new_opacity]
+
+
+def _interpolate(start: Color, end: Color, ratio: float) -> Color:
+    return Color(
+        round(start._red + (end._red - start._red) * ratio),
+        round(start._green + (end._green - start._green) * ratio),
+        round(start._blue + (end._blue - start._blue) * ratio),
+        start._opacity + (end._opacity - start._opacity) * ratio,
+    )
 
 
 class GradientColor:
-    def __init__(self, gradient: Sequence[Color]):
+    """A smooth ramp between the `gradient` control points, placed at
+    `stops` (fractions in [0, 1], evenly spread if not given).  The ramp is
+    precomputed into a `SIZE` entry table, so a lookup is just indexing.
+
+    Values are percentages if they're `int`s and fractions if `float`s.
+    """
+
+    SIZE = 256
+
+    def __init__(
+        self,
+        gradient: Sequence[Color],
+        stops: Optional[Sequence[float]] = None,
+    ):
+        assert gradient, "a gradient needs at least one color"
         self.gradient = gradient
+        self.stops = (
+            stops
+            if stops is not None
+            else [i / max(len(gradient) - 1, 1) for i in range(len(gradient))]
+        )
+        assert len(self.stops) == len(gradient)
+        self._table = tuple(
+            self._color_at(n / (self.SIZE - 1)) for n in range(self.SIZE)
+        )
+        self._last = self.SIZE - 1
+
+    def _color_at(self, x: float) -> Color:
+        if len(self.gradient) == 1:
+            return self.gradient[0]
+
+        i = min(max(bisect.bisect_left(self.stops, x), 1), len(self.stops) - 1)
+        lo, hi = self.stops[i - 1], self.stops[i]
+        ratio = min(max((x - lo) / ((hi - lo) or 1), 0.0), 1.0)
+        return _interpolate(self.gradient[i - 1], self.gradient[i], ratio)
 
     def reversed(self) -> "GradientColor":
-        return self.__class__(self.gradient[::-1])
+        return self.__class__(
+            self.gradient[::-1], [1 - stop for stop in self.stops[::-1]]
+        )
+
+    def _index(self, value: Union[int, float]) -> int:
+        fraction = value / 100 if isinstance(value, int) else value
+        return min(max(int(fraction * self._last + 0.5), 0), self._last)
 
     def __call__(self, value: Union[int, float]) -> Color:
-        if isinstance(value, int):
-            idx = int(value / 100 * len(self.gradient))
-        else:
-            idx = int(value * len(self.gradient))
+        return self._table[self._index(value)]
 
-        return self.gradient[min(idx, len(self.gradient) - 1)]
+    def batch(self, values: Iterable[Union[int, float]]) -> List[Color]:
+        table, index = self._table, self._index
+        return [table[index(value)] for value in values]
 
 
 CLEAR = Color(0, 0, 0, 0.0)
@@ -105,9 +201,6 @@ ORANGE = Color(255, 102, 0)
 GREY = Color(153, 153, 153)
 DARK_GREY = Color(102, 102, 102)
 CYAN = Color(85, 170, 255)
-# Gradients, the idea is providing a stepped set of colors in a sequence
-GYR_GRADIENT = GradientColor(
-    [Color(int(i * 255 / 9), 204 + int(i * 51 / 9), 0) for i in range(10)]
-    + [Color(255, 255 - int(i * 255 / 10), 0) for i in range(1, 11)]
-)
+# Gradients, smooth ramps between a few control points
+GYR_GRADIENT = GradientColor([Color(0, 204, 0), YELLOW, RED])
 RYG_GRADIENT = GYR_GRADIENT.reversed()
@@ -1,26 +1,88 @@
 import os
+from bisect import bisect_left
 from enum import Enum
-from typing import Optional, Sequence, Union
+from functools import lru_cache
+from typing import Callable, Optional, Sequence, Tuple, Union
 
 from systemhud.ui import colors
 
 THEME = os.environ.get("ICON_THEME", "")
 
 
+Underline = Union[bool, colors.Color, None]
+RENDER_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def _template(
+    fg: Optional[colors.Color],
+    bg: Optional[colors.Color],
+    offset: Union[bool, int, None],
+    underline: Underline,
+) -> Tuple[str, str]:
+    # the formatting that goes before and after the glyph
+    prefix, suffix = "", ""
+    if offset:
+        prefix, suffix = f"  %{{O-{offset}}}", f" %{{O-{offset}}}"
+    if fg:
+        prefix, suffix = f"%{{F#{fg}}}{prefix}", f"{suffix}%{{F-}}"
+    if bg:
+        prefix, suffix = f"%{{B#{bg}}}{prefix}", f"{suffix}%{{B-}}"
+    if underline:
+        prefix, suffix = f"%{{+u}}{prefix}", f"{suffix}%{{-u}}"
+        if isinstance(underline, colors.Color):
+            prefix, suffix = f"%{{u{underline}}}{prefix}", f"{suffix}%{{u-}}"
+
+    return prefix, suffix
+
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render(
+    glyph: str,
+    fg: Optional[colors.Color] = None,
+    bg: Optional[colors.Color] = None,
+    offset: Union[bool, int, None] = None,
+    underline: Underline = None,
+) -> str:
+    """The polybar formatted icon, applets cycle through a handful of states
+    so these are nearly always already rendered."""
+    prefix, suffix = _template(fg, bg, offset, underline)
+    return prefix + glyph + suffix
+
+
 class BaseIcon:
+    """An immutable glyph and its formatting, subclasses are free to add
+    (mutable) attributes of their own."""
+
+    __slots__ = ("icon", "fg", "bg", "offset", "underline")
+
+    icon: str
+    fg: Optional[colors.Color]
+    bg: Optional[colors.Color]
+    offset: Union[bool, int, None]
+    underline: Underline
+
     def __init__(
         self,
         char: str,
         fg: Optional[colors.Color] = None,
         bg: Optional[colors.Color] = None,
         offset: Union[bool, int, None] = None,
-        underline: Union[bool, colors.Color, None] = None,
+        underline: Underline = None,
     ):
-        self.icon = char
-        self.fg = fg
-        self.bg = bg
-        self.offset = 11 if offset is True else offset
-        self.underline = underline
+        for name, value in (
+            ("icon", char),
+            ("fg", fg),
+            ("bg", bg),
+            ("offset", 11 if offset is True else offset),
+            ("underline", underline),
+        ):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name: str, value: object) -> None:
+        if name in BaseIcon.__slots__:
+            raise AttributeError(f"{name} of an icon can't be changed")
+        object.__setattr__(self, name, value)
 
     def __repr__(self) -> str:
         out = f"<Icon({self.icon}"
@@ -35,52 +97,66 @@ class BaseIcon:
         return out + ")>"
 
     def __str__(self) -> str:
-        out = self.icon
-        if self.offset:
-            out = f"  %{{O-{self.offset}}}{out} %{{O-{self.offset}}}"
-        if self.fg:
-            out = f"%{{F#{self.fg}}}{out}%{{F-}}"
-        if self.bg:
-            out = f"%{{B#{self.bg}}}{out}%{{B-}}"
-        if self.underline:
-            out = f"%{{+u}}{out}%{{-u}}"
-            if isinstance(self.underline, colors.Color):
-                out = f"%{{u{self.underline}}}{out}%{{u-}}"
+        return render(self.icon, self.fg, self.bg, self.offset, self.underline)
 
-        return out
+
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def _derived(
+    cls: Callable[..., BaseIcon],
+    char: str,
+    fg: Optional[colors.Color],
+    bg: Optional[colors.Color],
+    offset: Union[bool, int, None],
+    underline: Underline,
+) -> BaseIcon:
+    # icons are immutable, so the variants asked for get shared
+    return cls(char, fg=fg, bg=bg, offset=offset, underline=underline)
 
 
 class Icon(BaseIcon):
+    __slots__ = ()
+
     def __call__(
         self,
         foreground: Optional[colors.Color] = None,
         background: Optional[colors.Color] = None,
         offset: Union[bool, int, None] = None,
-        underline: Union[bool, colors.Color, None] = None,
+        underline: Underline = None,
     ) -> "Icon":
-        return self.__class__(
+        # typed as what it is used for here, mypy doesn't see a class as
+        # hashable for the cache
+        cls: Callable[..., BaseIcon] = self.__class__
+        icon = _derived(
+            cls,
             self.icon,
-            fg=foreground if foreground else self.fg,
-            bg=background if background else self.bg,
-            offset=offset if offset else self.offset,
-            underline=underline if underline else self.underline,
+            foreground if foreground else self.fg,
+            background if background else self.bg,
+            offset if offset else self.offset,
+            underline if underline else self.underline,
         )
+        assert isinstance(icon, Icon)
+        return icon
 
 
 class ProgressiveIcon(BaseIcon):
+    __slots__ = ("progression", "_length", "_icons")
+
     def __init__(self, progression: Sequence[str]):
         self.progression = progression
         self._length = len(progression)
+        self._icons = tuple(Icon(char) for char in progression)
 
     def __call__(self, v: Union[int, float]) -> BaseIcon:
         if isinstance(v, int):
             idx = int(v / 100 * self._length)
         else:
             idx = int(v * self._length)
-        return Icon(self.progression[min(idx, self._length - 1)])
+        return self._icons[min(idx, self._length - 1)]
 
 
 class GradientIcon(BaseIcon):
+    __slots__ = ("fg_gradient",)
+
     GYR_GRADIENT = colors.GYR_GRADIENT
     RYG_GRADIENT = colors.RYG_GRADIENT
     DEFAULT_GRADIENT = colors.GYR_GRADIENT
@@ -92,16 +168,105 @@ class GradientIcon(BaseIcon):
         super().__init__(char)
 
     def __call__(self, v: Union[int, float]) -> BaseIcon:
-        return BaseIcon(
+        return _derived(
+            BaseIcon,
             self.icon,
-            fg=self.fg_gradient(v),
-            bg=self.bg,
-            offset=self.offset,
-            underline=self.underline,
+            self.fg_gradient(v),
+            self.bg,
+            self.offset,
+            self.underline,
         )
 
 
+# opacity steps of the dot in the value's bracket, see `_eqdots_bracket`
+EQDOTS_STEPS = 17
+
+
+def _eqdots_bracket(
+    value: Union[int, float], levels: Sequence[int]
+) -> Tuple[int, int]:
+    """Which bracket of `levels` a (non zero) value is in, the bracket past
+    `levels[n - 1]` up to `levels[n]` being n, and the opacity step of the
+    bracket's dot.  Everything about how the value renders follows from
+    these two."""
+    bracket = bisect_left(levels, value)
+    if bracket == 0 or bracket == len(levels):
+        return bracket, 0
+
+    min_threshold, max_threshold = levels[bracket - 1], levels[bracket]
+    # when in the final threshold bracket, we apply an opacity to the dot,
+    # ranging from 50% to 100% (lower opacities were barely noticeable),
+    # basically 8*(percent between min and max) + 8
+    return (
+        bracket,
+        int((value - min_threshold) * 8 / (max_threshold - min_threshold)) + 8,
+    )
+
+
+def _eqdots_dots(
+    bracket: int,
+    step: int,
+    icons: Sequence[str],
+    levels: Sequence[int],
+    dot_colors: Sequence[colors.Color],
+) -> str:
+    dots = []
+    for n, (color, icon) in enumerate(
+        zip(dot_colors, icons[: len(levels) - 1]), 1
+    ):
+        if n < bracket:
+            dots.append(f"%{{F{color}}}{icon}%{{F-}}")
+        elif n == bracket:
+            dots.append(f"%{{F#{color.with_opacity(step)}}}{icon}%{{F-}}")
+            break
+
+    return "%{O-11}".join(dots)
+
+
+@lru_cache(maxsize=16)
+def _eqdots_table(
+    icons: str,
+    levels: Tuple[int, ...],
+    dot_colors: Tuple[colors.Color, ...],
+    zero_color: colors.Color,
+) -> Tuple[str, ...]:
+    """Every 0-100 integer value's render."""
+    return (f"%{{F{zero_color}}}{icons[0]}%{{F-}}",) + tuple(
+        _eqdots_dots(*_eqdots_bracket(value, levels), icons, levels, dot_colors)
+        for value in range(1, 101)
+    )
+
+
+@lru_cache(maxsize=16)
+def _eqdots_steps(
+    icons: str,
+    levels: Tuple[int, ...],
+    dot_colors: Tuple[colors.Color, ...],
+) -> Tuple[Tuple[str, ...], ...]:
+    """Every render there is, indexed by bracket then opacity step."""
+    return tuple(
+        tuple(
+            _eqdots_dots(bracket, step, icons, levels, dot_colors)
+            for step in range(EQDOTS_STEPS)
+        )
+        for bracket in range(len(levels) + 1)
+    )
+
+
 class EqDotsIcon(BaseIcon):
+    """Renders a 0-100 value as a row of dots, every possible render of a
+    palette is built up front (and shared between icons with the same
+    palette) so showing a value is an index into that table."""
+
+    __slots__ = (
+        "value",
+        "levels",
+        "colors",
+        "zero_color",
+        "_table",
+        "_steps",
+    )
+
     ICONS: Sequence[str] = "⡀⠄⠂⠁"
     LEVELS: Sequence[int] = [0, 25, 50, 75, 100]
     COLORS: Sequence[colors.Color] = [
@@ -126,6 +291,15 @@ class EqDotsIcon(BaseIcon):
         self.levels = levels if levels else self.LEVELS
         self.colors = colors if colors else self.COLORS
         self.zero_color = zero_color or self.ZERO_COLOR
+        self._table = _eqdots_table(
+            "".join(self.ICONS),
+            tuple(self.levels),
+            tuple(self.colors),
+            self.zero_color,
+        )
+        self._steps = _eqdots_steps(
+            "".join(self.ICONS), tuple(self.levels), tuple(self.colors)
+        )
 
     def __call__(self, v: Union[int, float]) -> "EqDotsIcon":
         return self.__class__(
@@ -135,37 +309,17 @@ class EqDotsIcon(BaseIcon):
             value=v,
         )
 
-    def __str__(self) -> str:
-        if self.value == 0:
-            return f"%{{F{self.zero_color}}}{self.ICONS[0]}%{{F-}}"
+    def render(self, value: Union[int, float]) -> str:
+        if isinstance(value, int) and 0 <= value <= 100:
+            return self._table[value]
+        if value == 0:
+            return self._table[0]
 
-        dots = ""
-        for min_threshold, max_threshold, color, icon in zip(
-            self.levels, self.levels[1:], self.colors, self.ICONS
-        ):
-            if self.value > max_threshold:
-                if dots:
-                    dots += "%{O-11}"
-                dots += f"%{{F{color}}}{icon}%{{F-}}"
-            elif self.value > min_threshold:
-                # when in the final threshold bracket, we apply an opacity
-                # to the dot, ranging from 50% to 100% (lower opacities were
-                # barely noticeable)
-                if dots:
-                    dots += "%{O-11}"
-                # basically 8*(percent between min and max) + 8
-                internal_bracket = (
-                    int(
-                        (self.value - min_threshold)
-                        * 8
-                        / (max_threshold - min_threshold)
-                    )
-                    + 8
-                )
-                dots += f"%{{F#{color.with_opacity(internal_bracket)}}}{icon}%{{F-}}"
-                break
-
-        return dots
+        bracket, step = _eqdots_bracket(value, self.levels)
+        return self._steps[bracket][step]
+
+    def __str__(self) -> str:
+        return self.render(self.value)
 
 
 class EnumIcon(Icon, Enum):
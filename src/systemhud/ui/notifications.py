@@ -1,28 +1,182 @@
-from os import getuid
+import asyncio
+import fcntl
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from enum import IntEnum
+from hashlib import blake2b
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterator, NamedTuple, Optional, Set
 
+from systemhud import dbus
 from systemhud.ui import colors, pango
+from systemhud.util import runtime_dir
+
+NOTIFICATIONS = "org.freedesktop.Notifications"
+NOTIFICATIONS_PATH = "/org/freedesktop/Notifications"
+HINT_TYPES = {bool: "b", float: "d", int: "i", str: "s"}
+# the id registry: a header and then slots of (name hash, id)
+REGISTRY_MAGIC = b"hudids01"
+REGISTRY_HEADER = struct.Struct("<8sI4x")
+REGISTRY_SLOT = struct.Struct("<QI4x")
+REGISTRY_SLOTS = 256
 
 
 def progress_bar(
     n: int, width: int = 20, color: colors.Color = colors.Color("33CC33")
 ) -> str:
-    bar = pango.span_tag(background=color)
+    bar = pango.Markup().open(background=color)
     step_size = int(100 / width)
     progress = n
     for _ in range(width):
         if progress <= 0 and progress > step_size * -1:
-            bar += pango.CLOSE_TAG + pango.span_tag(background=colors.GREY)
+            bar.close().open(background=colors.GREY)
 
-        bar += " "
+        bar.raw(" ")
         progress -= step_size
 
-    bar += pango.CLOSE_TAG
-    return pango.wrap(bar, font=pango.MONOSPACE, size="16") + "\n"
+    bar.close()
+    return str(
+        pango.Markup().span(bar, font=pango.MONOSPACE, size="16").newline()
+    )
+
+
+class NotificationClient:
+    """Sends notifications straight to the notification server over the
+    (shared) session bus connection, so showing one is a single async
+    message rather than a blocking libnotify round trip."""
+
+    def __init__(self, bus_address: Optional[str] = None):
+        self.bus_address = bus_address
+
+    async def notify(
+        self,
+        app_name: str,
+        replaces_id: int,
+        icon: str,
+        summary: str,
+        body: str,
+        hints: Dict[str, Any],
+        timeout: int,
+    ) -> int:
+        bus = await dbus.get_bus(dbus.SESSION, self.bus_address)
+        (notification_id,) = await dbus.call(
+            bus,
+            NOTIFICATIONS,
+            NOTIFICATIONS_PATH,
+            NOTIFICATIONS,
+            "Notify",
+            "susssasa{sv}i",
+            [app_name, replaces_id, icon, summary, body, [], hints, timeout],
+        )
+        return notification_id
+
+    async def release(self) -> None:
+        await dbus.release(dbus.SESSION, self.bus_address)
+
+
+client = NotificationClient()
+
+
+class Urgency(IntEnum):
+    LOW = 0
+    NORMAL = 1
+    CRITICAL = 2
+
+
+class Update(NamedTuple):
+    """The contents of a single showing of a notification."""
+
+    title: str
+    body: str
+    icon: Optional[str]
+    timeout: int
+    image: Optional[str] = None
+    progress: Optional[int] = None
+    urgency: Optional[Urgency] = None
+
+
+class Coalescer:
+    """Merges bursts of updates to the same notification (i.e. holding the
+    volume key) so only the latest content of a burst is sent, once the
+    `window` has passed and no sooner than `min_interval` after the last
+    one sent for that notification.  Immediate updates skip the wait and
+    drop whatever was pending for the notification.
+    """
+
+    def __init__(self, window: float = 0.1, min_interval: float = 0.3):
+        self.window = window
+        self.min_interval = min_interval
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self._latest: Dict["Notification", Update] = {}
+        self._timers: Dict["Notification", "asyncio.Task[None]"] = {}
+        self._last_sent: Dict["Notification", float] = {}
+        # sends in flight, referenced so they aren't collected before
+        # finishing
+        self._sending: Set["asyncio.Task[None]"] = set()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "sent": self.sent,
+            "merged": self.merged,
+            "dropped": self.dropped,
+        }
+
+    def submit(
+        self, notification: "Notification", update: Update, immediate: bool
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        if immediate:
+            timer = self._timers.pop(notification, None)
+            if timer is not None:
+                timer.cancel()
+                del self._latest[notification]
+                self.dropped += 1
+            self._send(notification, update)
+        elif notification in self._timers:
+            self._latest[notification] = update
+            self.merged += 1
+        else:
+            delay = max(
+                self.window,
+                self._last_sent.get(notification, float("-inf"))
+                + self.min_interval
+                - loop.time(),
+            )
+            self._latest[notification] = update
+            self._timers[notification] = loop.create_task(
+                self._send_later(notification, delay)
+            )
+
+    async def _send_later(
+        self, notification: "Notification", delay: float
+    ) -> None:
+        await asyncio.sleep(delay)
+        del self._timers[notification]
+        self._send(notification, self._latest.pop(notification))
+
+    def _send(self, notification: "Notification", update: Update) -> None:
+        self.sent += 1
+        self._last_sent[notification] = asyncio.get_running_loop().time()
+        task = asyncio.get_running_loop().create_task(
+            notification._send(update)
+        )
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+
+coalescer = Coalescer()
 
 
 class Notification:
+    """A notification that replaces itself when shown again.  Goes through
+    the shared `NotificationClient` when `dbus-next` is installed and
+    libnotify (through `gi`) otherwise."""
+
     def __init__(
         self,
         name: str = "polybar",
@@ -30,6 +184,7 @@ class Notification:
         transient: bool = False,
         timeout: int = 4000,
         hints: Optional[Dict[str, Any]] = None,
+        bus_address: Optional[str] = None,
     ):
         self.name = name
         self.icon = icon
@@ -37,6 +192,11 @@ class Notification:
         self._notification_ref = None
         self._timeout = timeout
         self.hints = hints if hints else {}
+        self.id = 0
+        self._sending: Optional[asyncio.Lock] = None
+        self.client = (
+            client if bus_address is None else NotificationClient(bus_address)
+        )
 
     @property
     def ref(self) -> Any:
@@ -119,6 +279,94 @@ class Notification:
 
         self._notification_ref.set_hint("value", GLib.Variant("i", l))
 
+    def _set_urgency(self, urgency: Optional[Urgency]) -> None:
+        if not self._notification_ref or urgency is None:
+            return
+
+        from gi.repository import GLib
+
+        self._notification_ref.set_hint("urgency", GLib.Variant("y", urgency))
+
+    def _dbus_hints(self, update: Update) -> Dict[str, Any]:
+        hints = {
+            k: dbus.variant(HINT_TYPES[type(v)], v)
+            for k, v in self.hints.items()
+            if type(v) in HINT_TYPES
+        }
+        if self._transient:
+            hints["transient"] = dbus.variant("i", 1)
+        if update.image:
+            image = update.image
+            if image.startswith(".") or image.startswith("/"):
+                image = f"file://{image}"
+            hints["image-path"] = dbus.variant("s", image)
+        if update.progress:
+            hints["value"] = dbus.variant("i", update.progress)
+        if update.urgency is not None:
+            hints["urgency"] = dbus.variant("y", int(update.urgency))
+
+        return hints
+
+    async def _send(self, update: Update) -> None:
+        if not dbus.available():
+            self._show_libnotify(update)
+            return
+
+        # one at a time, each needs the id the previous one was given to
+        # replace it
+        if self._sending is None:
+            self._sending = asyncio.Lock()
+        try:
+            async with self._sending:
+                self.id = await self.client.notify(
+                    self.name,
+                    self.id,
+                    update.icon or "",
+                    update.title,
+                    update.body,
+                    self._dbus_hints(update),
+                    update.timeout,
+                )
+        except Exception:
+            # i.e. no session bus, libnotify may still find a way
+            self._show_libnotify(update)
+            return
+
+        self._sent()
+
+    def _sent(self) -> None:
+        """Called once the server has handed out the notification's id."""
+
+    def _show_libnotify(self, update: Update) -> None:
+        ref = self.ref
+        ref.update(update.title, update.body, update.icon)
+        if update.image:
+            self._set_image(update.image)
+        if update.progress:
+            self._set_progress(update.progress)
+        self._set_urgency(update.urgency)
+        self._set_transient()
+        self.timeout = update.timeout
+        ref.show()
+        self.id = ref.props.id
+        self._sent()
+
+    def _dispatch(self, update: Update, immediate: bool) -> None:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # one off scripts, there is no loop to keep the connection on
+            async def send_once() -> None:
+                await self._send(update)
+                await self.client.release()
+
+            asyncio.run(send_once())
+            # the lock belonged to that loop
+            self._sending = None
+            return
+
+        coalescer.submit(self, update, immediate)
+
     def __call__(
         self,
         title: str,
@@ -128,43 +376,135 @@ class Notification:
         image: Optional[str] = None,
         transient: Optional[bool] = None,
         progress: Optional[int] = None,
-    ):
-        timeout = timeout or self.timeout
-        icon = icon or self.icon
-        self.ref.update(title, body, icon)
-        if image:
-            self._set_image(image)
-        if progress:
-            self._set_progress(progress)
-        if transient is not None and transient != self._transient:
+        urgency: Optional[Urgency] = None,
+    ) -> None:
+        update = Update(
+            title,
+            body,
+            icon or self.icon,
+            timeout or self.timeout,
+            image,
+            progress,
+            urgency,
+        )
+        if transient is not None:
             self._transient = transient
-            self._set_transient()
-        self.timeout = timeout
-        self.ref.show()
+
+        # only a critical update is shown right away, everything else
+        # (transient or not) goes through the coalescer so a flapping state
+        # is merged whichever way it flaps
+        self._dispatch(update, urgency is Urgency.CRITICAL)
+
+
+class IdRegistry:
+    """The ids of tracked notifications, shared between every process of
+    the session through a memory mapped table of fixed slots (open
+    addressed by a hash of the name), so looking up or updating an id is
+    a few reads of the mapping rather than a file per notification.
+    Access is serialized with `flock` on the table's file.
+    """
+
+    def __init__(
+        self, path: Optional[Path] = None, slots: int = REGISTRY_SLOTS
+    ):
+        self.path = path
+        self.slots = slots
+        self._map: Optional[mmap.mmap] = None
+        self._fd = -1
+
+    @property
+    def size(self) -> int:
+        return REGISTRY_HEADER.size + REGISTRY_SLOT.size * self.slots
+
+    def _open(self) -> mmap.mmap:
+        if self._map is None:
+            if self.path is None:
+                self.path = runtime_dir() / "notifications.ids"
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            with self._locked(fcntl.LOCK_EX):
+                if os.fstat(self._fd).st_size != self.size:
+                    os.ftruncate(self._fd, 0)
+                    os.ftruncate(self._fd, self.size)
+                self._map = mmap.mmap(self._fd, self.size)
+                magic, slots = REGISTRY_HEADER.unpack_from(self._map)
+                if magic != REGISTRY_MAGIC or slots != self.slots:
+                    self._map[:] = bytes(self.size)
+                    REGISTRY_HEADER.pack_into(
+                        self._map, 0, REGISTRY_MAGIC, self.slots
+                    )
+
+        return self._map
+
+    @contextmanager
+    def _locked(self, operation: int) -> Iterator[None]:
+        fcntl.flock(self._fd, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _key(name: str) -> int:
+        # 0 marks an empty slot
+        digest = blake2b(name.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little") or 1
+
+    def _find(self, table: mmap.mmap, key: int) -> int:
+        """The offset of the slot holding the key, or the one it goes into.
+        A full table gives up the key's first choice."""
+        home = key % self.slots
+        for i in range(self.slots):
+            offset = (
+                REGISTRY_HEADER.size
+                + ((home + i) % self.slots) * REGISTRY_SLOT.size
+            )
+            slot_key, _ = REGISTRY_SLOT.unpack_from(table, offset)
+            if slot_key in (key, 0):
+                return offset
+
+        return REGISTRY_HEADER.size + home * REGISTRY_SLOT.size
+
+    def get(self, name: str) -> int:
+        table = self._open()
+        key = self._key(name)
+        with self._locked(fcntl.LOCK_SH):
+            slot_key, notification_id = REGISTRY_SLOT.unpack_from(
+                table, self._find(table, key)
+            )
+        return notification_id if slot_key == key else 0
+
+    def set(self, name: str, notification_id: int) -> None:
+        table = self._open()
+        key = self._key(name)
+        with self._locked(fcntl.LOCK_EX):
+            REGISTRY_SLOT.pack_into(
+                table, self._find(table, key), key, notification_id
+            )
+
+
+ids = IdRegistry()
 
 
 class TrackedNotification(Notification):
-    def __init__(self, name: str, **kwargs: Any):
-        self.id_file = Path(f"/var/run/user/{getuid()}/notifications/{name}.id")
-        if not self.id_file.parent.is_dir():
-            self.id_file.parent.mkdir(parents=True)
+    """Keeps its id in the session's `IdRegistry`, so separate runs of a
+    script (i.e. every brightness change) replace the same notification."""
 
+    def __init__(self, name: str, **kwargs: Any):
         super().__init__(name, **kwargs)
+        try:
+            self.id = ids.get(name)
+        except OSError:
+            pass
 
-    def __call__(
-        self,
-        title: str,
-        body: str,
-        icon: Optional[str] = None,
-        timeout: Optional[int] = None,
-        image: Optional[str] = None,
-        transient: Optional[bool] = None,
-        progress: Optional[int] = None,
-    ) -> None:
-        if self.id_file.exists():
-            self.ref.set_property("id", int(self.id_file.read_text()))
-        else:
-            self.id_file.touch()
-
-        super().__call__(title, body, icon, timeout, image, transient, progress)
-        self.id_file.write_text(str(self.ref.props.id))
+    @property
+    def ref(self) -> Any:
+        ref = super().ref
+        if self.id:
+            ref.set_property("id", self.id)
+        return ref
+
+    def _sent(self) -> None:
+        try:
+            ids.set(self.name, self.id)
+        except OSError:
+            pass
@@ -1,4 +1,6 @@
-from typing import Callable, List, Optional
+from functools import lru_cache
+from html import escape as _escape
+from typing import Callable, List, Optional, Union
 
 from systemhud.ui import colors
 
@@ -6,11 +8,18 @@ MONOSPACE = "Anonymice Nerd Font Mono"
 CLOSE_TAG = "</span>"
 
 
+def escape(text: str) -> str:
+    """Makes arbitrary text (process names, track titles, ...) safe to put
+    in markup."""
+    return _escape(text, quote=False)
+
+
+@lru_cache(maxsize=256)
 def span_tag(
     foreground: Optional[colors.Color] = None,
     background: Optional[colors.Color] = None,
     font: Optional[str] = None,
-    size: Optional[int] = None,
+    size: Union[int, str, None] = None,
     weight: Optional[str] = None,
     underline: Optional[str] = None,
 ) -> str:
@@ -46,3 +55,50 @@ def wrapped(**props) -> Callable[[str], str]:
         return wrap(contents, **props)
 
     return wrapper
+
+
+class Markup:
+    """Builds up markup as a list of fragments, joined once when rendered,
+    rather than growing a string.  Text is escaped unless it is added
+    through `raw`, all of the methods return the builder so calls can be
+    chained.
+    """
+
+    def __init__(self, *text: str):
+        self._fragments: List[str] = [escape(t) for t in text]
+        self._open = 0
+
+    def text(self, text: str) -> "Markup":
+        self._fragments.append(escape(text))
+        return self
+
+    def raw(self, markup: str) -> "Markup":
+        self._fragments.append(markup)
+        return self
+
+    def open(self, **props) -> "Markup":
+        self._fragments.append(span_tag(**props))
+        self._open += 1
+        return self
+
+    def close(self) -> "Markup":
+        assert self._open > 0, "no open span to close"
+        self._fragments.append(CLOSE_TAG)
+        self._open -= 1
+        return self
+
+    def span(self, contents: Union[str, "Markup"], **props) -> "Markup":
+        self.open(**props)
+        if isinstance(contents, Markup):
+            self._fragments += contents._fragments
+            self._fragments.append(CLOSE_TAG * contents._open)
+        else:
+            self.text(contents)
+        return self.close()
+
+    def newline(self) -> "Markup":
+        self._fragments.append("\n")
+        return self
+
+    def __str__(self) -> str:
+        return "".join(self._fragments) + CLOSE_TAG * self._open
@@ -1,11 +1,21 @@
 import asyncio
 import shutil
 from enum import Enum
-from typing import Dict, List, Optional, Sequence
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Iterable,
+    List,
+    Optional,
+    Sized,
+    Union,
+)
 
 from systemhud import PKG_ROOT
 
 ROFI_BIN = shutil.which("rofi")
+# how many entries the menu is sized for when it can't be known up front
+DEFAULT_COLUMNS = 4
 
 
 class Position(str, Enum):
@@ -37,8 +47,16 @@ class Entry:
 
     def __str__(self) -> str:
         out = self.name
+        options = []
         if self.icon:
-            out += f"\x00icon\x1f{self.icon}"
+            options.append(f"icon\x1f{self.icon}")
+        # the per row active/urgent options need at least rofi 1.7.0
+        if self.is_active:
+            options.append("active\x1ftrue")
+        if self.is_urgent:
+            options.append("urgent\x1ftrue")
+        if options:
+            out += "\x00" + "\x1f".join(options)
 
         return out
 
@@ -53,48 +71,75 @@ class Entry:
         return f"<Entry: {self.name}{meta}>"
 
 
+Entries = Union[Iterable[Entry], AsyncIterable[Entry]]
+
+
+async def _entries(entries: Entries) -> AsyncIterator[Entry]:
+    if isinstance(entries, AsyncIterable):
+        async for entry in entries:
+            yield entry
+    else:
+        for entry in entries:
+            yield entry
+
+
+async def _feed(
+    stdin: asyncio.StreamWriter, entries: Entries, sent: List[Entry]
+) -> None:
+    try:
+        async for entry in _entries(entries):
+            stdin.write(str(entry).encode("utf-8") + b"\n")
+            sent.append(entry)
+            await stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        # rofi was closed before everything was listed
+        return
+    finally:
+        if not stdin.is_closing():
+            stdin.close()
+
+
 async def rofi(
-    entries: Sequence[Entry],
+    entries: Entries,
     message: str = "",
     theme: str = "icons",
     position: Position = Position.TOPRIGHT,
+    columns: Optional[int] = None,
 ) -> Optional[Entry]:
+    """Shows the menu right away and lists the entries as they come, so a
+    generator can still be querying for the rest while rofi is up.  The
+    layout is sized for `columns` entries, defaulting to the number of
+    entries when that is known up front.
+    """
     assert ROFI_BIN is not None, "rofi is not installed."
 
-    urgents: List[str] = []
-    actives: List[str] = []
-    items: List[str] = []
-    lookup: Dict[str, Entry] = {}
-
-    for i, entry in enumerate(entries):
-        if entry.is_urgent:
-            urgents.append(str(i))
-        if entry.is_active:
-            actives.append(str(i))
-
-        items.append(str(entry))
-        lookup[entry.name] = entry
+    if columns is None:
+        columns = (
+            len(entries) if isinstance(entries, Sized) else DEFAULT_COLUMNS
+        )
 
     args = [
         "-no-config",
         "-dmenu",
+        "-async-pre-read",
+        "0",
+        "-format",
+        "i",
         "-theme",
         str(PKG_ROOT / f"etc/rofi/{theme}.rasi"),
     ]
-    args += ["-u", ",".join(urgents)] if urgents else []
-    args += ["-a", ",".join(actives)] if actives else []
     args += ["-mesg", message] if message else []
-    args += ["-theme-str", f"window {{ location: {position}; }}"]
+    args += ["-theme-str", f"window {{ location: {position.value}; }}"]
     if theme == "icons":
         args += [
             "-theme-str",
             (
-                f"listview {{ columns: {len(items)}; }} "
-                f"window {{ width: {len(items) * 80 + 40}; }}"
+                f"listview {{ columns: {columns}; }} "
+                f"window {{ width: {columns * 80 + 40}; }}"
             ),
         ]
     else:
-        args += ["-lines", str(len(items))]
+        args += ["-lines", str(columns)]
 
     rofi_proc = await asyncio.create_subprocess_exec(
         ROFI_BIN,
@@ -102,9 +147,25 @@ async def rofi(
         stdin=asyncio.subprocess.PIPE,
         stdout=asyncio.subprocess.PIPE,
     )
+    assert rofi_proc.stdin is not None
+    assert rofi_proc.stdout is not None
+
+    # rows are picked by their position, so entries can share a name
+    sent: List[Entry] = []
+    feeding = asyncio.ensure_future(_feed(rofi_proc.stdin, entries, sent))
+    try:
+        stdout = await rofi_proc.stdout.read()
+        await rofi_proc.wait()
+    finally:
+        feeding.cancel()
 
-    stdout, _ = await rofi_proc.communicate("\n".join(items).encode("utf-8"))
     if rofi_proc.returncode != 0:
         return None
 
-    return lookup[stdout.decode().strip()]
+    try:
+        selected = int(stdout.decode().strip())
+    except ValueError:
+        return None
+
+    # anything typed in rather than picked isn't one of the entries
+    return sent[selected] if 0 <= selected < len(sent) else None
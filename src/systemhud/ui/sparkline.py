@@ -0,0 +1,26 @@
+from typing import List, Optional, Sequence
+
+BLOCKS = "▁▂▃▄▅▆▇█"
+
+
+def sparkline(
+    values: Sequence[float],
+    low: float = 0.0,
+    high: float = 100.0,
+    width: Optional[int] = None,
+) -> str:
+    """One block character per value (scaled between `low` and `high`),
+    values are averaged down to `width` characters when there are more."""
+    if width and len(values) > width:
+        step = len(values) / width
+        chunks: List[Sequence[float]] = [
+            values[int(i * step) : int((i + 1) * step)] for i in range(width)
+        ]
+        values = [sum(chunk) / len(chunk) for chunk in chunks]
+
+    span = (high - low) or 1.0
+    top = len(BLOCKS) - 1
+    return "".join(
+        BLOCKS[max(0, min(top, int((v - low) / span * top + 0.5)))]
+        for v in values
+    )
@@ -1,7 +1,7 @@
 import enum
 import re
 import sys
-from os import getpid, getuid
+from os import environ, getpid, getuid
 from pathlib import Path
 from typing import Optional, Type, TypeVar
 
@@ -19,6 +19,16 @@ def set_pidfile(name: str) -> None:
         pidfile.write(str(getpid()))
 
 
+def runtime_dir() -> Path:
+    """Where the per session state (sockets, shared tables) is kept."""
+    path = (
+        Path(environ.get("XDG_RUNTIME_DIR", f"/run/user/{getuid()}"))
+        / "systemhud"
+    )
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    return path
+
+
 def strip_ansi(src: str) -> str:
     for f in [ANSI_STRIP, NONPRINTABLE_STRIP]:
         src = f.sub("", src)
@@ -29,11 +39,8 @@ def strip_ansi(src: str) -> str:
 class ReversableEnum(enum.Enum):
     @classmethod
     def rlookup(cls: Type[T], src: str) -> Optional[T]:
-        for i in cls:
-            if i.value == src:
-                return i
-
-        return None
+        # the enum machinery already keeps a value -> member table around
+        return cls._value2member_map_.get(src)  # type: ignore
 
     def __str__(self) -> str:
         return self.value
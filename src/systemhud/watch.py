@@ -0,0 +1,133 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+# watching the directory covers the file being replaced through a rename
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+)
+EVENT_HEADER = struct.Struct("iIII")
+# how often `wait` checks the file when inotify isn't available
+FALLBACK_PERIOD = 30
+
+
+def _inotify_watch(directory: Path) -> Optional[int]:
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+
+    if libc.inotify_add_watch(fd, str(directory).encode(), WATCH_MASK) < 0:
+        os.close(fd)
+        return None
+
+    return fd
+
+
+class FileWatcher:
+    """Tells whether a file changed since it was last asked.  Backed by an
+    inotify watch on the parent directory, so checking is a single
+    non-blocking read, and falls back to comparing `stat` results where
+    inotify can't be used.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        # bumped for every change seen, whoever asked
+        self.generation = 0
+        self._fd = _inotify_watch(path.parent)
+        self._stat = self._stat_key()
+        # one reader on the inotify fd wakes every concurrent `wait`
+        self._readable: Optional[asyncio.Event] = None
+        self._waiters = 0
+
+    def _stat_key(self) -> Tuple[int, int, int]:
+        try:
+            stat = self.path.stat()
+        except OSError:
+            return 0, 0, 0
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _event_names(self, buf: bytes) -> Iterator[str]:
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buf):
+            _, _, _, name_len = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            yield buf[offset : offset + name_len].rstrip(b"\0").decode()
+            offset += name_len
+
+    def changed(self) -> bool:
+        changed = self._changed()
+        if changed:
+            self.generation += 1
+        return changed
+
+    def _changed(self) -> bool:
+        if self._fd is None:
+            stat_key = self._stat_key()
+            changed = stat_key != self._stat
+            self._stat = stat_key
+            return changed
+
+        changed = False
+        while True:
+            try:
+                buf = os.read(self._fd, 4096)
+            except BlockingIOError:
+                break
+            if not buf:
+                break
+
+            changed = changed or self.path.name in self._event_names(buf)
+
+        return changed
+
+    async def wait(self) -> None:
+        """Returns once the file has changed, including when the change was
+        picked up by a `changed` call from elsewhere in the meantime."""
+        generation = self.generation
+        if self._fd is None:
+            while not self.changed() and self.generation == generation:
+                await asyncio.sleep(FALLBACK_PERIOD)
+            return
+
+        loop = asyncio.get_running_loop()
+        if self._readable is None:
+            self._readable = asyncio.Event()
+            loop.add_reader(self._fd, self._readable.set)
+        readable = self._readable
+        self._waiters += 1
+        try:
+            # a waiter clearing it doesn't undo the wakeup of the others, the
+            # first to read the events bumps the generation they check
+            while not self.changed() and self.generation == generation:
+                readable.clear()
+                await readable.wait()
+        finally:
+            self._waiters -= 1
+            if not self._waiters:
+                loop.remove_reader(self._fd)
+                self._readable = None
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None